@@ -0,0 +1,73 @@
+"""
+Benchmark the memory of duplicate request filters.
+
+Adds request fingerprints to scrapy's set of fingerprints and to
+crawler.dupefilter.ScalableBloomFilter, reports the memory each
+takes and the rate of new fingerprints the Bloom filter reports
+as already seen.
+
+Usage, from the repository root:
+
+    python -m benchmarks.dupefilter_memory
+    python -m benchmarks.dupefilter_memory --requests 5000000 --error-rate 0.01
+
+"""
+import argparse
+import time
+import tracemalloc
+
+from scrapy import Request
+from scrapy.utils.request import RequestFingerprinter
+
+from crawler.dupefilter import ScalableBloomFilter
+
+
+def fingerprints(count, offset=0):
+    fingerprinter = RequestFingerprinter()
+    for num in range(offset, offset + count):
+        yield fingerprinter.fingerprint(Request(f'https://example.org/record/{num}?page={num % 10}'))
+
+
+def measure(new, keys):
+    started = time.perf_counter()
+    seen = new()
+    for key in keys:
+        seen.add(key)
+    rate = len(keys) / (time.perf_counter() - started)
+
+    tracemalloc.start()
+    seen = new()
+    for key in keys:
+        seen.add(bytes(bytearray(key)))  # a copy kept by the set as in a crawl
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return seen, size, rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000000)
+    parser.add_argument('--capacity', type=int, default=1000000)
+    parser.add_argument('--error-rate', type=float, default=0.001)
+    args = parser.parse_args()
+
+    keys = list(fingerprints(args.requests))
+    print(f'{args.requests} fingerprints')
+
+    _, set_size, set_rate = measure(set, keys)
+    bloom, bloom_size, bloom_rate = measure(
+        lambda: ScalableBloomFilter(args.capacity, args.error_rate), keys)
+
+    probes = list(fingerprints(100000, offset=args.requests))
+    false_positives = sum(key in bloom for key in probes) / len(probes)
+    missed = sum(key not in bloom for key in keys[:100000])
+
+    print(f'    set: {set_size / 1e6:7.1f} MB, {set_rate:9.0f} adds/s')
+    print(f'  bloom: {bloom_size / 1e6:7.1f} MB, {bloom_rate:9.0f} adds/s, '
+          f'{len(bloom.filters)} filters')
+    print(f'  false positives: {false_positives:.3%} (at most {args.error_rate:.3%}), '
+          f'false negatives: {missed}')
+
+
+if __name__ == '__main__':
+    main()
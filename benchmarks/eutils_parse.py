@@ -0,0 +1,224 @@
+"""
+Benchmark PubMed efetch XML parsing.
+
+Compares the streaming parser in crawler.upload.helper with the
+previous parser that built the whole document tree first, checks
+that both produce identical grants and citations, and reports
+articles per second and peak memory.
+
+Usage, from the repository root:
+
+    python -m benchmarks.eutils_parse                 # synthetic payloads
+    python -m benchmarks.eutils_parse efetch1.xml ... # saved efetch responses
+
+"""
+import sys
+import time
+import tracemalloc
+import warnings
+import xml.etree.ElementTree as ElementTree
+
+from crawler.upload.helper import parse_pmid_eutils
+
+ARTICLE = """
+<PubmedArticle>
+  <MedlineCitation Status="MEDLINE" Owner="NLM">
+    <PMID Version="1">{pmid}</PMID>
+    <Article PubModel="Print">
+      <Journal>
+        <JournalIssue CitedMedium="Internet">
+          <Volume>{volume}</Volume>
+          <Issue>{issue}</Issue>
+          <PubDate>{pubdate}</PubDate>
+        </JournalIssue>
+      </Journal>
+      <ArticleTitle>Synthetic article number {pmid} about gene expression.</ArticleTitle>
+      <Pagination><MedlinePgn>{page}-{page_end}</MedlinePgn></Pagination>
+      <Abstract><AbstractText>{abstract}</AbstractText></Abstract>
+      <AuthorList CompleteYN="Y">{authors}</AuthorList>
+      <GrantList CompleteYN="Y">{grants}</GrantList>
+    </Article>
+    <MedlineJournalInfo><MedlineTA>J Synth Biol</MedlineTA></MedlineJournalInfo>
+  </MedlineCitation>
+  <PubmedData><ArticleIdList><ArticleId IdType="pubmed">{pmid}</ArticleId></ArticleIdList></PubmedData>
+</PubmedArticle>"""
+
+PUBDATES = (
+    "<Year>2019</Year><Month>Mar</Month><Day>07</Day>",
+    "<Year>2018</Year><Month>11</Month>",
+    "<Year>2017</Year><Season>Spring</Season>",
+    "<MedlineDate>2016 Jan-Feb</MedlineDate>",
+)
+
+
+def synthetic_payload(num_articles):
+    articles = []
+    for num in range(num_articles):
+        authors = ''.join(
+            f'<Author ValidYN="{"N" if index == 3 else "Y"}"><LastName>Name{index}</LastName>'
+            f'<ForeName>First</ForeName><Initials>F{index}</Initials>'
+            + ('<Suffix>Jr</Suffix>' if index == 2 else '') + '</Author>'
+            for index in range(num % 9))
+        if num % 7 == 0:
+            authors += '<Author><CollectiveName>Synthetic Consortium</CollectiveName></Author>'
+        grants = ''.join(
+            f'<Grant><GrantID>R01 GM{num:06d}-{index}</GrantID><Agency>NIGMS NIH HHS</Agency>'
+            '<Country>United States</Country></Grant>'
+            for index in range(num % 4))
+        articles.append(ARTICLE.format(
+            pmid=10000000 + num, volume=num % 50, issue=num % 12,
+            pubdate=PUBDATES[num % len(PUBDATES)],
+            page=num % 900, page_end=num % 900 + 12,
+            abstract='Lorem ipsum dolor sit amet. ' * 40,
+            authors=authors, grants=grants))
+    return '<?xml version="1.0" ?>\n<PubmedArticleSet>' + ''.join(articles) + '</PubmedArticleSet>'
+
+
+def parse_with_tree(body):
+    """The previous parser, building the whole tree first."""
+    root = ElementTree.fromstring(body)
+    ret = {}
+
+    # func. to build partial string
+    def construct_cite_partial(xml, features):
+        partial_cite = ''
+        for feature, template in features:
+            if xml.find(feature) is not None:
+                text = xml.find(feature).text
+                partial_cite += template.format(text)
+        return partial_cite
+
+    for pubmed_article in root.findall('.//PubmedArticle'):
+        pmid = pubmed_article.find('.//MedlineCitation/PMID').text
+        grants = []
+        for grant_element in pubmed_article.findall('.//Grant'):
+            grant = {}
+            if grant_element.find('Agency') is not None:
+                grant['funder'] = {
+                    '@type': 'Organization',
+                    'name': grant_element.find('Agency').text
+                }
+            if grant_element.find('GrantID') is not None:
+                grant['identifier'] = grant_element.find('GrantID').text
+            if grant:
+                grants.append(grant)
+        # citation field
+        # ANSI/NISO Z39.29-2005 (R2010), I don't have time to implement the full specs, and I cannot find any library
+        citation = ''
+
+        # author string
+        authors = []
+        for author in pubmed_article.findall('.//Author'):
+            # Check for ValidYN==Y attribute
+            # Mostly articles with errata in Authors field
+            # see PMID: 16155929, 16202713, 17371979, 18047569, etc.
+            valid = author.attrib.get('ValidYN', 'Y')
+            if valid == 'N':
+                continue
+            if author.find('LastName') is not None:
+                names = [author.find('LastName').text, author.find('Initials').text]
+                if author.find('Suffix') is not None:
+                    names.append(author.find('Suffix').text)
+                authors.append(" ".join(names))
+            elif author.find('CollectiveName') is not None:
+                # Has a dot at the end, see PMID:17571346
+                authors.append(author.find('CollectiveName').text + '.')
+            else:
+                warnings.warn(f"Unable to process an author in when handling PMID:{pmid}", RuntimeWarning)
+
+        if len(authors) > 4:
+            string = ', '.join(authors[:4])
+            string += ' et al. '
+            citation += string
+
+        elif len(authors) > 1:
+            string = ', '.join(authors)
+            string += '. '
+            citation += string
+
+        elif len(authors) == 1:
+            citation += authors[0]
+            citation += '. '
+        # See PMID:20703210
+        elif len(authors) == 0:
+            citation += "[No authors listed] "
+        else:
+            pass  # unreachable
+        # FIXME: Does not handle elements with tags inside
+        #  Like having <i>more text</i>, see PMID:28289389 for example.
+        citation += construct_cite_partial(pubmed_article, (
+            ('.//MedlineCitation/Article/ArticleTitle', '{} '),
+            ('.//MedlineCitation/MedlineJournalInfo/MedlineTA', '{}'),
+        ))
+        pubdate = pubmed_article.find('.//MedlineCitation/Article/Journal/JournalIssue/PubDate')
+        # There are lots of ways to express the date, so far I have seen:
+        #   - Year, Month, Day
+        #   - Year, Month
+        #   - Year, Season
+        #   - MedlineDate
+        # So far concatenating everything seems to produce desirable results
+        month_abbr = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+        if pubdate is not None:
+            date_texts = []
+            for elem in pubdate:
+                if elem.tag == 'Day':
+                    # deal with days that begin with 0
+                    date_texts.append(str(int(elem.text)))
+                elif elem.tag == 'Month':
+                    # deal with months that are numbers
+                    if elem.text.isdigit():
+                        date_texts.append(month_abbr[int(elem.text)])
+                    else:
+                        date_texts.append(elem.text)
+                else:
+                    date_texts.append(elem.text)
+            if len(date_texts) > 0:
+                citation += " " + " ".join(date_texts)
+        citation += ';'  # add the semicolon
+
+        citation += construct_cite_partial(pubmed_article, (
+            ('.//MedlineCitation/Article/Journal/JournalIssue/Volume', '{}'),
+            ('.//MedlineCitation/Article/Journal/JournalIssue/Issue', '({})'),
+            ('.//MedlineCitation/Article/Pagination/MedlinePgn', ':{}'),
+        ))
+        citation += '.'
+        citation += construct_cite_partial(pubmed_article, (
+            ('.//MedlineCitation/PMID', ' PMID: {}'),
+        ))
+        ret[pmid] = {
+            'grants': grants,
+            'citation': citation
+        }
+    return ret
+
+
+def measure(parse, body):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = parse(body)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main(paths):
+    if paths:
+        payloads = [(path, open(path, encoding='utf-8').read()) for path in paths]
+    else:
+        payloads = [(f'{num} synthetic articles', synthetic_payload(num)) for num in (200, 500, 2000)]
+
+    warnings.simplefilter('ignore', RuntimeWarning)
+    for name, body in payloads:
+        print(f'{name}, {len(body) / 1e6:.1f} MB')
+        results = []
+        for label, parse in (('tree', parse_with_tree), ('streaming', parse_pmid_eutils)):
+            result, elapsed, peak = measure(parse, body)
+            results.append(result)
+            print(f'  {label:>9}: {len(result) / elapsed:8.0f} articles/s, '
+                  f'peak {peak / 1e6:6.1f} MB above the payload')
+        print('  identical output:', results[0] == results[1])
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
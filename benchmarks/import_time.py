@@ -0,0 +1,63 @@
+"""
+Benchmark the import time of crawler modules.
+
+Every module is imported in fresh interpreters, and the median
+time and the uploader modules loaded along with it are reported.
+Importing the pipeline or the upload package should not load any
+uploader module, those are imported when looked up by name.
+
+Usage, from the repository root:
+
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --runs 20 crawler.pipelines
+
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = (
+    'crawler.upload',
+    'crawler.pipelines',
+    'crawler.upload.zenodo_covid',
+)
+
+CHILD = """
+import json, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    'elapsed': elapsed,
+    'loaded': sorted(name for name in sys.modules if name.startswith('crawler.upload.'))
+}}))
+"""
+
+
+def measure(module, runs):
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, '-c', CHILD.format(module=module)],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.splitlines()[-1])
+        timings.append(result['elapsed'])
+    return statistics.median(timings), result['loaded']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('modules', nargs='*', default=MODULES)
+    parser.add_argument('--runs', type=int, default=10)
+    args = parser.parse_args()
+
+    for module in args.modules:
+        elapsed, loaded = measure(module, args.runs)
+        print(f'{module}: {elapsed * 1000:.0f} ms')
+        print(f'  loaded: {", ".join(loaded) or "-"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""
+Benchmark JSON-LD extraction from pages.
+
+Compares scanning pages for ld+json script blocks with
+crawler.spiders.helper.scan_jsonld against parsing them in full
+with extruct, checks that both produce the same items, and
+reports pages per second.
+
+Usage, from the repository root:
+
+    python -m benchmarks.jsonld_extract                  # synthetic pages
+    python -m benchmarks.jsonld_extract pages/ page.html # saved pages
+
+"""
+import argparse
+import json
+import os
+import time
+
+from extruct.jsonld import JsonLdExtractor
+
+from crawler.spiders.helper import scan_jsonld
+
+ITEM = {
+    "@context": "https://schema.org/",
+    "@type": "Dataset",
+    "name": "Synthetic dataset about gene expression",
+    "description": "Lorem ipsum dolor sit amet. " * 50,
+    "creator": [{"@type": "Person", "name": f"Author {num}"} for num in range(20)],
+    "keywords": [f"keyword {num}" for num in range(30)],
+}
+
+
+def synthetic_page(rows):
+    table = ''.join(
+        f'<tr class="row"><td><a href="/record/{num}">Record {num}</a></td>'
+        f'<td><span title="file">file_{num}.csv</span></td><td>{num * 17} kB</td></tr>'
+        for num in range(rows))
+    return (
+        '<!DOCTYPE html><html><head><title>Record</title>'
+        '<!-- analytics --><script>var config = {"debug": false};</script>'
+        f'<script type="application/ld+json">{json.dumps(ITEM)}</script>'
+        f'</head><body><div id="main"><table>{table}</table></div></body></html>'
+    ).encode()
+
+
+def read_pages(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                yield from read_pages([os.path.join(path, name)])
+        else:
+            with open(path, 'rb') as file:
+                yield path, file.read()
+
+
+def measure(extract, pages, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = [extract(body) for _, body in pages]
+    return results, len(pages) * repeat / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('paths', nargs='*', help='saved pages or directories of them')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.paths:
+        pages = list(read_pages(args.paths))
+    else:
+        pages = [(f'synthetic {rows} rows', synthetic_page(rows)) for rows in (10, 100, 1000, 5000)] * 5
+    print(f'{len(pages)} pages, {sum(len(body) for _, body in pages) / 1e6:.1f} MB')
+
+    extractor = JsonLdExtractor()
+    full, full_rate = measure(extractor.extract, pages, args.repeat)
+    fast, fast_rate = measure(scan_jsonld, pages, args.repeat)
+
+    fallbacks = sum(items is None for items in fast)
+    different = [
+        name for (name, _), expected, items in zip(pages, full, fast)
+        if items is not None and items != expected
+    ]
+    print(f'   extruct: {full_rate:8.1f} pages/s')
+    print(f'      scan: {fast_rate:8.1f} pages/s, {fallbacks} pages left to the full parser')
+    print(f'  identical output: {not different}')
+    for name in different:
+        print(f'    differs: {name}')
+
+
+if __name__ == '__main__':
+    main()
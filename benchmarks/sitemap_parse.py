@@ -0,0 +1,108 @@
+"""
+Benchmark reading a large gzipped sitemap.
+
+Compares scrapy's Sitemap, which decompresses the whole body and
+builds its tree before the first entry, against
+crawler.spiders.sitemap.SitemapStream, which decompresses and
+parses incrementally. Each parser runs in a fresh process so that
+peak memory includes lxml's own allocations, and both must produce
+the same entries.
+
+Usage, from the repository root:
+
+    python -m benchmarks.sitemap_parse                 # synthetic sitemap
+    python -m benchmarks.sitemap_parse sitemap.xml.gz  # saved sitemap
+
+"""
+import argparse
+import gzip
+import hashlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from scrapy.utils.gz import gunzip
+from scrapy.utils.sitemap import Sitemap
+
+from crawler.spiders.sitemap import SitemapStream
+
+
+def synthetic_sitemap(path, entries):
+    with gzip.open(path, 'wt') as file:
+        file.write(
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">')
+        for num in range(entries):
+            file.write(
+                f'<url><loc>https://example.org/record/{num}</loc>'
+                f'<lastmod>2020-01-{num % 28 + 1:02d}</lastmod>'
+                '<changefreq>monthly</changefreq></url>')
+        file.write('</urlset>')
+
+
+def read_scrapy(body):
+    return iter(Sitemap(gunzip(body, max_size=0)))
+
+
+def read_stream(body):
+    return iter(SitemapStream(gzip.GzipFile(fileobj=io.BytesIO(body))))
+
+
+def run(parser, path):
+    """
+    Read the sitemap in this process, print the results as JSON.
+    """
+    with open(path, 'rb') as file:
+        body = file.read()
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    started = time.perf_counter()
+    digest, count = hashlib.sha1(), 0
+    for entry in {'scrapy': read_scrapy, 'stream': read_stream}[parser](body):
+        digest.update(json.dumps(entry, sort_keys=True).encode())
+        count += 1
+    elapsed = time.perf_counter() - started
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - baseline
+    print(json.dumps({'count': count, 'digest': digest.hexdigest(), 'seconds': elapsed, 'peak_kb': peak}))
+
+
+def measure(parser, path):
+    output = subprocess.run(
+        [sys.executable, '-m', 'benchmarks.sitemap_parse', '--run', parser, path],
+        check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('path', nargs='?', help='a saved sitemap, gzipped')
+    parser.add_argument('--entries', type=int, default=500000)
+    parser.add_argument('--run', choices=('scrapy', 'stream'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        return run(args.run, args.path)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.path
+        if not path:
+            path = os.path.join(tmp, 'sitemap.xml.gz')
+            synthetic_sitemap(path, args.entries)
+        print(f'{path}: {os.path.getsize(path) / 1e6:.1f} MB gzipped')
+
+        results = {name: measure(name, path) for name in ('scrapy', 'stream')}
+
+    for name, result in results.items():
+        print(f'  {name:>6}: {result["count"]} entries in {result["seconds"]:.2f}s, '
+              f'peak +{result["peak_kb"] / 1024:.1f} MB')
+    print(f'  identical output: {results["scrapy"]["digest"] == results["stream"]["digest"]}')
+
+
+if __name__ == '__main__':
+    main()
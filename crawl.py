@@ -1,7 +1,9 @@
 from scrapy.crawler import CrawlerProcess
 from scrapy.utils.project import get_project_settings
 
-process = CrawlerProcess(get_project_settings())
+# parse workers import this module again, see crawler.offload
+if __name__ == '__main__':
+    process = CrawlerProcess(get_project_settings())
 
-process.crawl('zenodo_covid')
-process.start()
+    process.crawl('zenodo_covid')
+    process.start()
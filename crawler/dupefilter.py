@@ -0,0 +1,225 @@
+"""
+Compact Duplicate Request Filter.
+
+Set as DUPEFILTER_CLASS by spiders following many links,
+see DUPEFILTER_* settings.
+
+* Request fingerprints are kept in a scalable Bloom filter,
+  about 2 MB per million requests at a 0.1% error rate,
+  instead of a set of about 90 MB.
+* A false positive drops a request never seen before, at most
+  DUPEFILTER_ERROR_RATE of them. Requests with dont_filter
+  are never dropped.
+* The filter grows by adding larger filters with lower error
+  rates, so the total error rate stays under the one set
+  whatever the number of requests.
+* With JOBDIR, the filter is saved there to resume the crawl,
+  every DUPEFILTER_SAVE_INTERVAL seconds and when the spider
+  closes. After a crash, requests made since the last save
+  may be made again.
+* With DUPEFILTER_PERSIST, the filter is saved in DUPEFILTER_DIR
+  as <spider>.bloom and loaded by the next run of the spider,
+  which then skips every request made by previous runs.
+  Not for spiders expected to request pages again, like the
+  incremental sitemap spiders when a <lastmod> moves forward.
+* The pages of previous runs are not scraped again, so they
+  would be lost from a crawl index recreated by the pipeline.
+  DUPEFILTER_PERSIST is ignored unless the spider keeps its
+  index, see recreate_index in crawler.pipelines. The clic and
+  figshare_brunel spiders keep it when the filter persists.
+
+Example:
+
+    class BroadSpider(CrawlSpider):
+
+        custom_settings = {
+            'DUPEFILTER_CLASS': 'crawler.dupefilter.BloomDupeFilter',
+        }
+
+        @property
+        def recreate_index(self):
+            return not self.settings.getbool('DUPEFILTER_PERSIST')
+
+    scrapy crawl clic -s DUPEFILTER_PERSIST=1
+
+"""
+import hashlib
+import logging
+import math
+import os
+import struct
+import time
+
+from scrapy.dupefilters import RFPDupeFilter
+from scrapy.utils.job import job_dir
+from scrapy.utils.project import data_path
+
+
+class BloomFilter:
+    """
+    A Bloom filter of a fixed capacity over byte strings.
+    """
+
+    def __init__(self, capacity, error_rate, bits=None, count=0):
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.count = count
+        # optimal sizes for the capacity and error rate
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bits if bits is not None else bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing, see Kirsch and Mitzenmacher
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        num_bits = self.num_bits
+        return [(first + num * second) % num_bits for num in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def add(self, key):
+        """
+        Add a key, return True if it may have been added before.
+        """
+        found = True
+        for pos in self._positions(key):
+            mask = 1 << (pos & 7)
+            if not self.bits[pos >> 3] & mask:
+                self.bits[pos >> 3] |= mask
+                found = False
+        if not found:
+            self.count += 1
+        return found
+
+
+class ScalableBloomFilter:
+    """
+    Bloom filters added as the previous one fills up, each twice
+    as large with half the error rate, see Almeida et al. 2007.
+    """
+
+    GROWTH = 2
+    TIGHTENING = 0.5
+    _HEADER = struct.Struct('<QdQQ')  # capacity, error rate, count, bytes
+
+    def __init__(self, capacity=1000000, error_rate=0.001):
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = []
+
+    def __contains__(self, key):
+        return any(key in bloom for bloom in self.filters)
+
+    def __len__(self):
+        return sum(bloom.count for bloom in self.filters)
+
+    @property
+    def nbytes(self):
+        return sum(len(bloom.bits) for bloom in self.filters)
+
+    def add(self, key):
+        """
+        Add a key, return True if it may have been added before.
+        """
+        if any(key in bloom for bloom in self.filters[:-1]):
+            return True
+        if not self.filters or self.filters[-1].count >= self.filters[-1].capacity:
+            if self.filters and key in self.filters[-1]:
+                return True
+            # the error rates add up to at most the one set
+            num = len(self.filters)
+            self.filters.append(BloomFilter(
+                self.capacity * self.GROWTH ** num,
+                self.error_rate * (1 - self.TIGHTENING) * self.TIGHTENING ** num))
+        return self.filters[-1].add(key)
+
+    def save(self, path):
+        """
+        Write the filters to a file, replaced atomically.
+        """
+        with open(path + '.tmp', 'wb') as file:
+            file.write(struct.pack('<QdI', self.capacity, self.error_rate, len(self.filters)))
+            for bloom in self.filters:
+                file.write(self._HEADER.pack(bloom.capacity, bloom.error_rate, bloom.count, len(bloom.bits)))
+                file.write(bloom.bits)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+
+        with open(path, 'rb') as file:
+            capacity, error_rate, num = struct.unpack('<QdI', file.read(struct.calcsize('<QdI')))
+            loaded = cls(capacity, error_rate)
+            for _ in range(num):
+                capacity, error_rate, count, size = cls._HEADER.unpack(file.read(cls._HEADER.size))
+                bits = bytearray(file.read(size))
+                if len(bits) != size:
+                    raise ValueError(f'Truncated Bloom filter file {path}.')
+                loaded.filters.append(BloomFilter(capacity, error_rate, bits, count))
+        return loaded
+
+
+class BloomDupeFilter(RFPDupeFilter):
+    """
+    Filter requests with the same fingerprint as scrapy's default,
+    keeping the fingerprints in a scalable Bloom filter.
+    """
+
+    def __init__(self, path=None, debug=False, *, fingerprinter=None,
+                 capacity=1000000, error_rate=0.001, save_interval=0):
+
+        super().__init__(None, debug, fingerprinter=fingerprinter)
+        self.path = path
+        self.save_interval = save_interval  # seconds, 0 to save on close only
+        self._last_save = time.monotonic()
+        self.bloom = None
+        if path and os.path.exists(path):
+            try:
+                self.bloom = ScalableBloomFilter.load(path)
+            except (OSError, ValueError, struct.error) as exc:
+                logging.warning('Ignoring duplicate filter %s: %s', path, exc)
+            else:
+                logging.info('Loaded duplicate filter of %s requests from %s.', len(self.bloom), path)
+        if self.bloom is None:
+            self.bloom = ScalableBloomFilter(capacity, error_rate)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        spider = crawler.spider
+        path, save_interval = None, 0
+        if job_dir(settings):
+            path = os.path.join(job_dir(settings), 'requests.bloom')
+            save_interval = settings.getfloat('DUPEFILTER_SAVE_INTERVAL', 60)
+        elif settings.getbool('DUPEFILTER_PERSIST'):
+            if getattr(spider, 'recreate_index', True):
+                logging.warning('Not persisting the duplicate filter of %s, '
+                                'which recreates its index.', spider.name)
+            else:
+                directory = data_path(settings.get('DUPEFILTER_DIR', 'dupefilter'), createdir=True)
+                path = os.path.join(directory, f'{spider.name}.bloom')
+        return cls(
+            path, settings.getbool('DUPEFILTER_DEBUG'),
+            fingerprinter=crawler.request_fingerprinter,
+            capacity=settings.getint('DUPEFILTER_CAPACITY', 1000000),
+            error_rate=settings.getfloat('DUPEFILTER_ERROR_RATE', 0.001),
+            save_interval=save_interval)
+
+    def request_seen(self, request):
+
+        seen = self.bloom.add(self._fingerprint(request))
+        if not seen and self.save_interval and \
+                time.monotonic() - self._last_save >= self.save_interval:
+            self.bloom.save(self.path)
+            self._last_save = time.monotonic()
+        return seen
+
+    def close(self, reason):
+        logging.info('Duplicate filter of %s requests in %.1f MB.', len(self.bloom), self.bloom.nbytes / 1e6)
+        if self.path:
+            self.bloom.save(self.path)
@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+
+# Define your extensions here
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/extensions.html
+
+"""
+Backpressure from the Elasticsearch Pipeline.
+
+* Enabled by ES_BACKPRESSURE_ENABLED, off unless a spider sets it.
+* Watch the number of items not yet written by ESPipeline.
+* Pause the engine when it reaches ES_BACKPRESSURE_HIGH.
+* Resume the engine when it drops to ES_BACKPRESSURE_LOW.
+* Check every ES_BACKPRESSURE_INTERVAL seconds.
+
+Parse Workers.
+
+* Size the process pool of crawler.offload with PARSE_WORKERS.
+* Stop the worker processes when the engine stops.
+
+"""
+import logging
+
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from twisted.internet import task
+
+from crawler.offload import parse_pool
+from crawler.pipelines import ESPipeline
+
+
+class ESBackpressure:
+    """
+    Keep pending Elasticsearch writes bounded during long crawls
+    by holding back new requests while the cluster catches up.
+    """
+
+    def __init__(self, crawler, high, low, interval):
+
+        self.crawler = crawler
+        self.stats = crawler.stats
+        self.high = high
+        self.low = low
+        self.interval = interval
+
+        self.pipeline = None
+        self.paused = False
+        self._task = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool('ES_BACKPRESSURE_ENABLED'):
+            raise NotConfigured
+
+        high = settings.getint('ES_BACKPRESSURE_HIGH', 5000)
+        low = settings.getint('ES_BACKPRESSURE_LOW', high // 2)
+        if not 0 <= low < high:
+            raise NotConfigured('ES_BACKPRESSURE_LOW must be below ES_BACKPRESSURE_HIGH.')
+
+        ext = cls(crawler, high, low, settings.getfloat('ES_BACKPRESSURE_INTERVAL', 1.0))
+        crawler.signals.connect(ext.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(ext.spider_closed, signal=signals.spider_closed)
+        return ext
+
+    def spider_opened(self, spider):
+
+        for pipeline in self.crawler.engine.scraper.itemproc.middlewares:
+            if isinstance(pipeline, ESPipeline):
+                self.pipeline = pipeline
+                break
+        else:
+            logging.warning('ESPipeline not enabled, backpressure disabled.')
+            return
+
+        self._task = task.LoopingCall(self.check, spider)
+        self._task.start(self.interval, now=False)
+
+    def spider_closed(self, spider):
+
+        if self._task and self._task.running:
+            self._task.stop()
+        if self.paused:
+            self.resume(spider)
+
+    def check(self, spider):
+
+        backlog = self.pipeline.pending_items
+        self.stats.set_value('es/backlog', backlog)
+        self.stats.max_value('es/backlog/max', backlog)
+
+        if not self.paused and backlog >= self.high:
+            self.pause(spider)
+        elif self.paused and backlog <= self.low:
+            self.resume(spider)
+
+    def pause(self, spider):
+
+        logging.info('Pausing %s, %s items waiting for Elasticsearch.',
+                     spider.name, self.pipeline.pending_items)
+        self.crawler.engine.pause()
+        self.paused = True
+        self.stats.inc_value('es/backlog/pauses')
+
+    def resume(self, spider):
+
+        logging.info('Resuming %s, %s items waiting for Elasticsearch.',
+                     spider.name, self.pipeline.pending_items)
+        self.crawler.engine.unpause()
+        self.paused = False
+
+
+class ParseWorkers:
+    """
+    Manage the worker processes that spiders offload parsing to.
+    """
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        workers = crawler.settings.getint('PARSE_WORKERS', 0)
+        parse_pool.configure(workers)
+        if not workers:
+            raise NotConfigured
+
+        ext = cls()
+        crawler.signals.connect(ext.engine_stopped, signal=signals.engine_stopped)
+        return ext
+
+    def engine_stopped(self):
+        parse_pool.shutdown()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+HTTP Cache for Recrawls.
+
+Use with RevalidateCacheMiddleware in place of scrapy's
+HttpCacheMiddleware, see HTTPCACHE_* settings.
+
+* RevalidatePolicy keeps responses that carry an ETag or a
+  Last-Modified header, and asks the server whether they changed
+  on every later request with If-None-Match / If-Modified-Since.
+* A 304 Not Modified answer is replaced by the stored response,
+  so callbacks receive the page as if it was downloaded again.
+* The stored response then gets the headers of the 304 and a
+  new stored time, from which HTTPCACHE_FRESH_SECS counts.
+* SQLiteCacheStorage keeps compressed responses in one SQLite
+  file per spider under HTTPCACHE_DIR.
+* Least recently used responses are evicted once the compressed
+  bodies exceed HTTPCACHE_MAX_BYTES, 0 for no limit.
+
+Stats: httpcache/hit, miss and revalidate (a 304) are counted
+by the middleware, httpcache/evicted and httpcache/bytes here.
+
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import zlib
+
+from scrapy.downloadermiddlewares.httpcache import HttpCacheMiddleware
+from scrapy.http.headers import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.project import data_path
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+
+
+class RevalidatePolicy:
+    """
+    Always revalidate cached responses with the server,
+    unless they were stored less than HTTPCACHE_FRESH_SECS ago.
+    """
+
+    def __init__(self, settings):
+
+        self.fresh_secs = settings.getint('HTTPCACHE_FRESH_SECS', 0)
+        self.ignore_schemes = settings.getlist('HTTPCACHE_IGNORE_SCHEMES')
+
+    def should_cache_request(self, request):
+
+        scheme = request.url.split(':', 1)[0]
+        return request.method == 'GET' and scheme not in self.ignore_schemes
+
+    def should_cache_response(self, response, request):
+
+        if response.status != 200:
+            return False
+        if b'no-store' in response.headers.get(b'Cache-Control', b'').lower():
+            return False
+        # without validators a stored page cannot be revalidated
+        return b'ETag' in response.headers or b'Last-Modified' in response.headers
+
+    def is_cached_response_fresh(self, cachedresponse, request):
+
+        stored = request.meta.get('cache_timestamp', 0)
+        if self.fresh_secs and time.time() - stored < self.fresh_secs:
+            return True
+
+        if b'ETag' in cachedresponse.headers:
+            request.headers[b'If-None-Match'] = cachedresponse.headers[b'ETag']
+        if b'Last-Modified' in cachedresponse.headers:
+            request.headers[b'If-Modified-Since'] = cachedresponse.headers[b'Last-Modified']
+        return False
+
+    def is_cached_response_valid(self, cachedresponse, response, request):
+
+        return response.status == 304
+
+
+class RevalidateCacheMiddleware(HttpCacheMiddleware):
+    """
+    Scrapy's HttpCacheMiddleware, also storing the response
+    revalidated by a 304, which scrapy before 2.19 only returns.
+    """
+
+    # sent again on a 304 but describing its own empty body
+    FRAMING_HEADERS = (b'Content-Length', b'Transfer-Encoding')
+
+    def process_response(self, request, response, spider=None):
+
+        stored = request.meta.get('cache_timestamp')
+        result = super().process_response(request, response, spider)
+        # stored by scrapy if it moved the timestamp
+        if response.status == 304 and result is not response \
+                and request.meta.get('cache_timestamp') == stored:
+            for name, values in response.headers.items():
+                if name not in self.FRAMING_HEADERS:
+                    result.headers.setlist(name, values)
+            self.storage.store_response(spider, request, result)
+        return result
+
+
+class SQLiteCacheStorage:
+    """
+    Compressed responses keyed by request fingerprint,
+    with the time each was last used for LRU eviction.
+    """
+
+    def __init__(self, settings):
+
+        self.cachedir = data_path(settings['HTTPCACHE_DIR'], createdir=True)
+        self.expiration_secs = settings.getint('HTTPCACHE_EXPIRATION_SECS')
+        self.max_bytes = settings.getint('HTTPCACHE_MAX_BYTES', 0)
+
+        self.conn = None
+        self.size = 0  # compressed bytes stored
+        self.stats = None
+        self._fingerprinter = None
+
+    def open_spider(self, spider):
+
+        path = os.path.join(self.cachedir, f'{spider.name}.sqlite')
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS responses ('
+            'fingerprint TEXT PRIMARY KEY, url TEXT, status INTEGER, headers BLOB, '
+            'body BLOB, digest TEXT, size INTEGER, stored REAL, accessed REAL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)')
+        self.size = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+
+        self.stats = spider.crawler.stats
+        self.stats.set_value('httpcache/bytes', self.size)
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        logging.debug('Using SQLite cache storage in %s.', path)
+
+    def close_spider(self, spider):
+
+        self.conn.close()
+        self.conn = None
+
+    def retrieve_response(self, spider, request):
+        """
+        Return the stored response, or None if not cached or expired.
+        """
+        key = self._fingerprinter.fingerprint(request).hex()
+        row = self.conn.execute(
+            'SELECT url, status, headers, body, stored FROM responses WHERE fingerprint = ?',
+            (key,)).fetchone()
+        if row is None:
+            return None
+        url, status, headers, body, stored = row
+        if 0 < self.expiration_secs < time.time() - stored:
+            return None
+
+        with self.conn:
+            self.conn.execute('UPDATE responses SET accessed = ? WHERE fingerprint = ?', (time.time(), key))
+        request.meta['cache_timestamp'] = stored
+
+        headers = Headers(headers_raw_to_dict(headers))
+        body = zlib.decompress(body)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        """
+        Store a response, or refresh the headers and time
+        of the stored one when the body did not change.
+        """
+        key = self._fingerprinter.fingerprint(request).hex()
+        digest = hashlib.sha1(response.body).hexdigest()
+        headers = response.headers.copy()
+        if b'Content-Length' in headers:
+            # not the empty body of a 304 merged by scrapy
+            headers[b'Content-Length'] = str(len(response.body))
+        headers = headers_dict_to_raw(headers)
+        now = time.time()
+        request.meta['cache_timestamp'] = now
+
+        with self.conn:
+            updated = self.conn.execute(
+                'UPDATE responses SET status = ?, headers = ?, stored = ?, accessed = ? '
+                'WHERE fingerprint = ? AND digest = ?',
+                (response.status, headers, now, now, key, digest)).rowcount
+            if updated:
+                return
+
+            row = self.conn.execute('SELECT size FROM responses WHERE fingerprint = ?', (key,)).fetchone()
+            body = zlib.compress(response.body)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (key, response.url, response.status, headers, body, digest, len(body), now, now))
+            self.size += len(body) - (row[0] if row else 0)
+
+        if self.max_bytes and self.size > self.max_bytes:
+            self._evict()
+        self.stats.set_value('httpcache/bytes', self.size)
+
+    def _evict(self):
+
+        # make room for a while, not just for the next response
+        target = self.max_bytes * 0.9
+        with self.conn:
+            rows = self.conn.execute('SELECT fingerprint, size FROM responses ORDER BY accessed')
+            keys = []
+            for key, size in rows:
+                if self.size <= target:
+                    break
+                keys.append((key,))
+                self.size -= size
+            self.conn.executemany('DELETE FROM responses WHERE fingerprint = ?', keys)
+
+        logging.debug('Evicted %s responses from the HTTP cache.', len(keys))
+        self.stats.inc_value('httpcache/evicted', len(keys))
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+
+# Define your middlewares here
+#
+# See documentation in:
+# https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
+
+"""
+Download Slots of Redirected Requests.
+
+* Scrapy keeps the download slot of a request when it is
+  redirected, so a redirect to another host is downloaded
+  with the concurrency and delay of the first host.
+* RedirectSlotMiddleware moves such requests to the slot of
+  their own host, so that DOWNLOAD_SLOTS settings for it,
+  like a declared Crawl-delay, apply to redirects too.
+* Slots set explicitly in request meta are kept.
+
+"""
+from urllib.parse import urlparse
+
+from scrapy.core.downloader import Downloader
+from scrapy.utils.httpobj import urlparse_cached
+
+
+class RedirectSlotMiddleware:
+
+    def process_request(self, request, spider=None):
+
+        redirect_urls = request.meta.get('redirect_urls')
+        if not redirect_urls:
+            return None
+        slot = request.meta.get(Downloader.DOWNLOAD_SLOT)
+        # the slot assigned by the downloader to the previous request
+        if slot is not None and slot == urlparse(redirect_urls[-1]).hostname \
+                and slot != urlparse_cached(request).hostname:
+            del request.meta[Downloader.DOWNLOAD_SLOT]
+        return None
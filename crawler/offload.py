@@ -0,0 +1,138 @@
+"""
+Process Pool for CPU-bound Parsing in Spiders.
+
+* Callbacks run on the reactor thread, so one crawl process
+  parses at most one page at a time.
+* Pure functions of the response body, like JSON-LD extraction
+  or scraping a table, can run in worker processes instead,
+  while the reactor keeps downloading.
+* Results are unpickled on the reactor thread, which costs
+  about as much as json.loads, so offload functions that
+  return much less than the body, not plain decoding.
+* The number of workers is the setting PARSE_WORKERS, set
+  by spiders that offload parsing, 0 by default to keep
+  running everything on the reactor thread.
+* Functions and their arguments and results are pickled,
+  so functions must be defined at the top level of a module.
+* Workers start from a fresh interpreter that imports the
+  main module again, so scripts starting a crawl must do it
+  under if __name__ == '__main__'.
+
+Example:
+
+    from crawler.offload import offloaded
+
+    def record_links(body):
+        return [hit['url'] for hit in json.loads(body)['hits']]
+
+    class APISpider(scrapy.Spider):
+
+        @offloaded(record_links)
+        def parse(self, response, links):
+            # links is record_links(response.body)
+            ...
+
+"""
+import functools
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from scrapy.utils.defer import maybe_deferred_to_future
+from scrapy.utils.misc import arg_to_iter
+from twisted.internet import defer
+
+
+class ParsePool:
+    """
+    A process pool started on first use, shared by all spiders
+    of the crawl process. Results are delivered as Deferreds
+    fired on the reactor thread.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._executor = None
+        self._pending = set()  # Deferreds not fired yet
+
+    def configure(self, workers):
+        self.shutdown()
+        self.workers = max(int(workers), 0)
+
+    def submit(self, func, *args):
+        """
+        Run func(*args) in a worker process.
+        Return a Deferred that fires with the result.
+        """
+        if not self.workers:
+            return defer.maybeDeferred(func, *args)
+
+        if self._executor is None:
+            # forking from the reactor's threads is unsafe,
+            # workers fork from a clean server process instead.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context(method))
+            logging.info('Started %s parse workers.', self.workers)
+
+        # imported late, spider modules load before the reactor is installed
+        from twisted.internet import reactor
+
+        done = defer.Deferred()
+        self._pending.add(done)
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(
+            lambda future: reactor.callFromThread(self._fire, done, future))
+        return done
+
+    def _fire(self, done, future):
+
+        if done.called:  # failed by shutdown()
+            return
+        self._pending.discard(done)
+        if future.cancelled():
+            done.errback(defer.CancelledError())
+            return
+        exc = future.exception()
+        if exc is None:
+            done.callback(future.result())
+        else:
+            done.errback(exc)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        # tasks queued to stopped workers never complete
+        pending, self._pending = self._pending, set()
+        for done in pending:
+            done.errback(defer.CancelledError())
+
+
+parse_pool = ParsePool()
+
+
+async def offload(func, *args):
+    """
+    Await func(*args) computed in the parse pool, from a coroutine callback.
+    """
+    return await maybe_deferred_to_future(parse_pool.submit(func, *args))
+
+
+def offloaded(extract):
+    """
+    Decorate a spider callback to receive extract(response.body)
+    computed in the parse pool as the argument after the response.
+    The callback itself still runs on the reactor thread, and
+    may return or yield items and requests as usual.
+    """
+    def decorator(callback):
+
+        @functools.wraps(callback)
+        async def wrapper(self, response, *args, **kwargs):
+            extracted = await offload(extract, response.body)
+            return list(arg_to_iter(callback(self, response, extracted, *args, **kwargs)))
+
+        return wrapper
+
+    return decorator
@@ -11,18 +11,41 @@ Elasticsearch Backend for Scrapy Spider.
 * Recommend setting up index mapping ahead of time.
 * Use Env ES_HOST to override default es address.
 * Use Env ES_INDEX to override spider name as index.
+* The index is recreated when first written to, unless the
+  spider sets recreate_index = False to add to what previous
+  runs indexed, like incremental spiders do.
 * Require Elasticsearch version ~6.5+.
 * Assume default doc_type or no doc_type.
 
+Bulk Mode:
+
+* Enabled when setting ES_BULK_SIZE is greater than 0.
+* Items are buffered and sent through the bulk API when
+  ES_BULK_SIZE items, ES_BULK_BYTES bytes of serialized items,
+  or ES_BULK_INTERVAL seconds since the last flush is reached.
+* Remaining items are flushed when the spider closes.
+
+Writes run on a worker thread pool off the reactor thread,
+with at most ES_CONCURRENT_WRITES requests in flight.
+
+Sends crawler.signals.item_indexed for each item written.
+
 """
+import json
 import logging
 import os
+import time
 
 from elasticsearch import Elasticsearch
+from twisted.internet import defer, reactor, task, threads
+from twisted.python.threadpool import ThreadPool
 
+from crawler.signals import item_indexed
 from crawler.upload import CrawlerIndices
 
-indices = CrawlerIndices(Elasticsearch(os.getenv('ES_HOST')))
+client = Elasticsearch(os.getenv('ES_HOST'))
+indices = CrawlerIndices(client)
+kept_indices = CrawlerIndices(client, recreate=False)
 
 
 class ESPipeline:
@@ -31,6 +54,69 @@ class ESPipeline:
     Spider name will be used as the index name.
     """
 
+    def __init__(self, bulk_size=0, bulk_bytes=0, bulk_interval=0,
+                 concurrent_writes=1, stats=None, signals=None):
+
+        self.bulk_size = bulk_size
+        self.bulk_bytes = bulk_bytes
+        self.bulk_interval = bulk_interval
+        self.concurrent_writes = max(concurrent_writes, 1)
+        self.stats = stats
+        self.signals = signals
+
+        self._indices = indices
+        self._pool = None
+        self._semaphore = defer.DeferredSemaphore(self.concurrent_writes)
+        self._pending = set()  # deferreds of requests in flight
+        self._in_flight = 0  # number of items in those requests
+
+        self._buffer = []  # (_id, item) pairs
+        self._buffer_bytes = 0
+        self._buffer_index = None
+        self._last_flush = time.monotonic()
+        self._timer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            bulk_size=settings.getint('ES_BULK_SIZE', 0),
+            bulk_bytes=settings.getint('ES_BULK_BYTES', 0),
+            bulk_interval=settings.getfloat('ES_BULK_INTERVAL', 0),
+            concurrent_writes=settings.getint('ES_CONCURRENT_WRITES', 1),
+            stats=crawler.stats,
+            signals=crawler.signals
+        )
+
+    @property
+    def pending_items(self):
+        """
+        Number of items received but not yet acknowledged by Elasticsearch.
+        """
+        return len(self._buffer) + self._in_flight
+
+    def open_spider(self, spider):
+
+        if not getattr(spider, 'recreate_index', True):
+            self._indices = kept_indices
+        self._pool = ThreadPool(
+            minthreads=1, maxthreads=self.concurrent_writes, name='ESPipeline')
+        self._pool.start()
+
+        if self.bulk_size and self.bulk_interval:
+            self._timer = task.LoopingCall(self._flush_if_stale, spider)
+            self._timer.start(self.bulk_interval, now=False)
+
+    def close_spider(self, spider):
+
+        if self._timer and self._timer.running:
+            self._timer.stop()
+        self.flush(spider)
+
+        finished = defer.DeferredList(list(self._pending))
+        finished.addBoth(lambda _: self._pool.stop())
+        return finished
+
     def process_item(self, item, spider):
         """
         Make Elasticsearch index request.
@@ -46,7 +132,98 @@ class ESPipeline:
         # FIXME: ES only allows lowercase
         _index = os.getenv('ES_INDEX', 'crawler_' + spider.name)
 
-        res = indices.index(_index, _id, item)
-        logging.debug(res)
+        if not self.bulk_size:
+            written = self._write(self._indices.index, _index, _id, item)
+            written.addCallback(logging.debug)
+            written.addCallback(lambda _: self._indexed(_id, item, spider))
+            written.addCallback(lambda _: item)
+            return written
+
+        if self._buffer_index not in (None, _index):
+            self.flush(spider)
+
+        self._buffer.append((_id, item))
+        self._buffer_index = _index
+        if self.bulk_bytes:
+            self._buffer_bytes += len(json.dumps(item, default=str))
+
+        if len(self._buffer) >= self.bulk_size or \
+                (self.bulk_bytes and self._buffer_bytes >= self.bulk_bytes):
+            # hold this item until the batch is written,
+            # so that the scraper slows down with Elasticsearch.
+            written = self.flush(spider)
+            written.addCallback(lambda _: item)
+            return written
 
         return item
+
+    def _write(self, func, *args, count=1):
+        """
+        Run a blocking client call on the worker pool.
+        Wait for a free slot if too many requests are in flight.
+        """
+        self._in_flight += count
+        written = self._semaphore.run(
+            threads.deferToThreadPool, reactor, self._pool, func, *args)
+        self._pending.add(written)
+
+        def _done(result):
+            self._in_flight -= count
+            self._pending.discard(written)
+            return result
+
+        return written.addBoth(_done)
+
+    def _flush_if_stale(self, spider):
+
+        if time.monotonic() - self._last_flush >= self.bulk_interval:
+            return self.flush(spider)
+        return None
+
+    def flush(self, spider):
+        """
+        Send buffered items with one bulk request.
+        Report every item the bulk response marks as failed.
+        Return a Deferred that fires when the request completes.
+        """
+        self._last_flush = time.monotonic()
+        if not self._buffer:
+            return defer.succeed(None)
+
+        docs, _index = self._buffer, self._buffer_index
+        self._buffer, self._buffer_bytes = [], 0
+
+        written = self._write(self._indices.bulk, _index, docs, count=len(docs))
+        written.addCallback(self._report, docs, _index, spider)
+        written.addErrback(self._report_failure, docs, _index)
+        return written
+
+    def _report(self, results, docs, _index, spider):
+
+        failed = 0
+        for (_id, item), (ok, result) in zip(docs, results):
+            if ok:
+                self._indexed(_id, item, spider)
+            else:
+                failed += 1
+                logging.error('Failed to index %s in %s: %s', _id, _index, result)
+
+        logging.debug('Bulk indexed %s items in %s, %s failed.', len(docs), _index, failed)
+        if self.stats:
+            self.stats.inc_value('es/bulk/requests')
+            self.stats.inc_value('es/bulk/items', len(docs))
+            self.stats.inc_value('es/bulk/errors', failed)
+
+    def _indexed(self, _id, item, spider):
+
+        if self.signals:
+            self.signals.send_catch_log(item_indexed, item=item, _id=_id, spider=spider)
+
+    def _report_failure(self, failure, docs, _index):
+
+        logging.error('Failed to bulk index %s items in %s: %s',
+                      len(docs), _index, failure.getErrorMessage())
+        if self.stats:
+            self.stats.inc_value('es/bulk/requests')
+            self.stats.inc_value('es/bulk/items', len(docs))
+            self.stats.inc_value('es/bulk/errors', len(docs))
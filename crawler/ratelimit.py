@@ -0,0 +1,110 @@
+"""
+Token Bucket Rate Limiter for Outbound API Calls
+
+* One bucket per host, refilled at the host's allowed rate.
+* Buckets live in a SQLite file, so that every thread and
+  process on the machine draws from the same budget.
+* Time spent waiting for a response counts towards the
+  budget, unlike sleeping a fixed time after each call.
+* Use Env RATELIMIT_DB to override the default file location.
+
+Example:
+
+    from crawler.ratelimit import rate_limiter
+
+    rate_limiter.wait(url)  # blocks until a request is allowed
+    requests.get(url)
+
+Scrapy spiders space out their requests with download_slots()
+as the DOWNLOAD_SLOTS setting instead, in the same process only.
+
+"""
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from urllib.parse import urlparse
+
+# requests per second, hosts not listed are not limited
+RATES = {
+    # NCBI allows 10 requests per second with an API key, 3 without
+    'eutils.ncbi.nlm.nih.gov': 10 if os.getenv('API_KEY') else 3,
+    'www.ncbi.nlm.nih.gov': 3,
+    # declared Crawl-delay: 10
+    'dataverse.harvard.edu': 0.1,
+}
+
+
+class RateLimiter:
+    """
+    Shared token buckets keyed by host.
+    A request reserves the next free slot of its bucket and
+    sleeps until then, so concurrent callers are spaced out
+    instead of retrying against each other.
+    """
+
+    def __init__(self, path, rates=None, burst=1):
+        self.path = path
+        self.rates = dict(RATES if rates is None else rates)
+        self.burst = burst  # requests allowed at once after idling
+        self._local = threading.local()
+
+    def _connect(self):
+        # sqlite connections can be shared by neither threads nor forked processes
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('CREATE TABLE IF NOT EXISTS buckets (host TEXT PRIMARY KEY, tokens REAL, updated REAL)')
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return self._local.conn
+
+    def reserve(self, host, rate):
+        """
+        Take a token from the bucket of host, refilling at rate per second.
+        Return the number of seconds to wait before using it.
+        """
+        conn = self._connect()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE host = ?', (host,)).fetchone()
+            now = time.time()
+            if row is None:
+                tokens = self.burst
+            else:
+                tokens = min(self.burst, row[0] + (now - row[1]) * rate)
+            tokens -= 1
+            conn.execute('INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)', (host, tokens, now))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return max(0.0, -tokens / rate)
+
+    def wait(self, url, rate=None):
+        """
+        Block until a request to the host of url is allowed.
+        The rate configured for the host is used unless one is given.
+        """
+        host = urlparse(url).hostname or url
+        rate = rate or self.rates.get(host)
+        if not rate:
+            return
+        delay = self.reserve(host, rate)
+        if delay:
+            time.sleep(delay)
+
+
+def download_slots(rates=None):
+    """
+    Scrapy DOWNLOAD_SLOTS setting for the same rates,
+    one request at a time per host.
+    """
+    rates = RATES if rates is None else rates
+    return {
+        host: {'concurrency': 1, 'delay': 1 / rate, 'jitter': 0}
+        for host, rate in rates.items()
+    }
+
+
+rate_limiter = RateLimiter(os.getenv(
+    'RATELIMIT_DB', os.path.join(tempfile.gettempdir(), 'biothings_crawler_ratelimit.sqlite')))
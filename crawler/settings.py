@@ -64,12 +64,21 @@ ROBOTSTXT_OBEY = False
 # DOWNLOADER_MIDDLEWARES = {
 #    'crawler.middlewares.DiscoveryDownloaderMiddleware': 543,
 # }
+# Also list these in spiders overriding DOWNLOADER_MIDDLEWARES
+DOWNLOADER_MIDDLEWARES = {
+    'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+    'crawler.httpcache.RevalidateCacheMiddleware': 900,
+}
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
 # EXTENSIONS = {
 #    'scrapy.extensions.telnet.TelnetConsole': None,
 # }
+EXTENSIONS = {
+    'crawler.extensions.ESBackpressure': 500,
+    'crawler.extensions.ParseWorkers': 500,
+}
 
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
@@ -77,6 +86,27 @@ ITEM_PIPELINES = {
     'crawler.pipelines.ESPipeline': 300,
 }
 
+# Buffer items and index them with the bulk API (0 to index one by one)
+ES_BULK_SIZE = 500
+# Flush earlier when the buffered items reach this many bytes (0 to disable)
+ES_BULK_BYTES = 10 * 1024 * 1024
+# Flush earlier when this many seconds passed since the last flush (0 to disable)
+ES_BULK_INTERVAL = 30
+# Maximum number of Elasticsearch requests in flight, off the reactor thread
+ES_CONCURRENT_WRITES = 4
+
+# Pause the crawl when this many items are waiting to be written to ES
+# and resume once the backlog drops to the low watermark
+# (off by default, enabled by spiders that outpace ES)
+ES_BACKPRESSURE_ENABLED = False
+ES_BACKPRESSURE_HIGH = 5000
+ES_BACKPRESSURE_LOW = 1000
+ES_BACKPRESSURE_INTERVAL = 1.0
+
+# Worker processes for parsing offloaded by spiders, see crawler.offload
+# (0 to parse on the reactor thread, set by spiders that offload)
+PARSE_WORKERS = 0
+
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
 AUTOTHROTTLE_ENABLED = True
@@ -92,11 +122,33 @@ AUTOTHROTTLE_TARGET_CONCURRENCY = 1.0
 
 # Enable and configure HTTP caching (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
-#HTTPCACHE_ENABLED = True
-#HTTPCACHE_EXPIRATION_SECS = 0
-#HTTPCACHE_DIR = 'httpcache'
-#HTTPCACHE_IGNORE_HTTP_CODES = []
-#HTTPCACHE_STORAGE = 'scrapy.extensions.httpcache.FilesystemCacheStorage'
+# Keep pages and revalidate them on recrawls, see crawler.httpcache,
+# enabled by spiders recrawling pages like the incremental sitemap spiders
+HTTPCACHE_ENABLED = False
+HTTPCACHE_EXPIRATION_SECS = 0
+HTTPCACHE_DIR = 'httpcache'
+HTTPCACHE_POLICY = 'crawler.httpcache.RevalidatePolicy'
+HTTPCACHE_STORAGE = 'crawler.httpcache.SQLiteCacheStorage'
+# Evict least recently used pages above this many compressed bytes (0 for no limit)
+HTTPCACHE_MAX_BYTES = 5 * 1024 ** 3
+# Use pages stored less than this many seconds ago without revalidating
+HTTPCACHE_FRESH_SECS = 0
+
+# Directory of the <lastmod> state kept by incremental sitemap spiders
+SITEMAP_STATE_DIR = 'sitemaps'
+# Child sitemaps downloaded or read at a time
+SITEMAP_CONCURRENCY = 2
+
+# Bloom filter of duplicate requests, for spiders setting it as their
+# DUPEFILTER_CLASS, see crawler.dupefilter
+# Requests before the filter grows, and the rate of new requests dropped
+DUPEFILTER_CAPACITY = 1000000
+DUPEFILTER_ERROR_RATE = 0.001
+# Seconds between saves of the filter to JOBDIR
+DUPEFILTER_SAVE_INTERVAL = 60
+# Keep the filter in this directory and skip requests made by previous runs
+DUPEFILTER_PERSIST = False
+DUPEFILTER_DIR = 'dupefilter'
 
 
 # Selenium settings
@@ -0,0 +1,9 @@
+"""
+Signals of the Crawler Project.
+
+* item_indexed: sent by ESPipeline with the item, its _id and
+  the spider once Elasticsearch acknowledged the write of the
+  item, so that spiders can record progress for stored items.
+
+"""
+item_indexed = object()
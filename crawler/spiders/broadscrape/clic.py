@@ -38,7 +38,7 @@ from scrapy.http import Request
 from scrapy.linkextractors import LinkExtractor
 from scrapy.spiders import Rule, Spider
 
-from ..helper import JsonLdMixin
+from ..helper import StructuredDataMixin
 
 LOG_FILENAME = 'clic.log'
 
@@ -53,9 +53,10 @@ handler = logging.handlers.RotatingFileHandler(
 logger.addHandler(handler)
 
 
-class CLICSpider(Spider, JsonLdMixin):
+class CLICSpider(Spider, StructuredDataMixin):
 
     name = 'clic'
+    metadata_syntaxes = ('json-ld', 'microdata')
     start_urls = ["https://clic-ctsa.org/hubs"]
     
     custom_settings = {
@@ -70,8 +71,15 @@ class CLICSpider(Spider, JsonLdMixin):
         # #does-scrapy-crawl-in-breadth-first-or-depth-first-order
         'DEPTH_PRIORITY': 1,
         'SCHEDULER_DISK_QUEUE': 'scrapy.squeues.PickleFifoDiskQueue',
-        'SCHEDULER_MEMORY_QUEUE': 'scrapy.squeues.FifoMemoryQueue'
+        'SCHEDULER_MEMORY_QUEUE': 'scrapy.squeues.FifoMemoryQueue',
+        'DUPEFILTER_CLASS': 'crawler.dupefilter.BloomDupeFilter',
     }
+
+    @property
+    def recreate_index(self):
+        # pages skipped by a persisted duplicate filter stay indexed
+        return not self.settings.getbool('DUPEFILTER_PERSIST')
+
     def start_requests(self):
         for url in self.start_urls:
             yield Request(url, callback=self.parse_start_url)
@@ -94,7 +102,7 @@ class CLICSpider(Spider, JsonLdMixin):
 
     def parse(self, response):
         logger.info(response.url)
-        for item in self.extract_jsonld(response, response.url):
+        for item in self.extract_metadata(response, response.url):
             yield item
         domain = urlparse(response.url).hostname or ''
         domain = domain.lstrip('www.')
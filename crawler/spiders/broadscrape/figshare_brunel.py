@@ -26,3 +26,11 @@ class FigshareBrunelSpider(CrawlSpider, JsonLdMixin):
         Rule(LinkExtractor(allow=r'/articles/'), callback='extract_jsonld'),
         Rule(LinkExtractor())
     )
+    custom_settings = {
+        'DUPEFILTER_CLASS': 'crawler.dupefilter.BloomDupeFilter',
+    }
+
+    @property
+    def recreate_index(self):
+        # pages skipped by a persisted duplicate filter stay indexed
+        return not self.settings.getbool('DUPEFILTER_PERSIST')
@@ -52,7 +52,7 @@ import os
 import scrapy
 from elasticsearch import Elasticsearch
 
-from ..helper import JsonLdMixin
+from ..helper import JsonLdMixin, indexed_ids
 
 
 class FigshareAPISpider(scrapy.Spider):
@@ -98,10 +98,12 @@ class FigshareAPISpider(scrapy.Spider):
 
         if isinstance(api_res, list):
 
+            indexed = indexed_ids(self.client, self.name, [item['id'] for item in api_res])
+
             for item in api_res:
                 published_date = item['published_date'][:10]
                 # skip already scrapped
-                if self.client.exists(index=self.name, id=item['id']):
+                if str(item['id']) in indexed:
                     logging.info('Skipping %s.', item['id'])
                     continue
                 item.update(_id=item['id'])
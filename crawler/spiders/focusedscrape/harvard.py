@@ -28,20 +28,60 @@ import logging
 import os
 
 import elasticsearch
-import requests
 import scrapy
+from twisted.internet import defer, threads
 
-from ..helper import JsonLdMixin
+from crawler.ratelimit import download_slots
+from crawler.signals import item_indexed
+
+from ..helper import JsonLdMixin, indexed_ids
+
+
+# one request at a time at the declared Crawl-delay,
+# for redirects from DOIs to dataverse.harvard.edu too
+DOWNLOAD_SLOTS = download_slots()
 
 
 class HarvardSpider(scrapy.Spider, JsonLdMixin):
+    """
+    Dataset JSON-LD from Harvard Dataverse
+
+    * By default, each dataset page listed by the search API
+      is downloaded and parsed for its JSON-LD.
+    * With -a mode=export, the search API is paged by up to
+      1000 items, and the JSON-LD of each dataset is requested
+      from the schema.org metadata export instead, which is
+      the same document the dataset page embeds.
+    """
 
     name = 'harvard'
     base_url = 'https://dataverse.harvard.edu/api/search?q=*&type=dataset'
-    start_urls = [
-        base_url
-    ]
+    export_url = 'https://dataverse.harvard.edu/api/datasets/export?exporter=schema.org&persistentId='
+    mode = 'page'  # or 'export'
+
+    custom_settings = {
+        # AutoThrottle would replace the delays of DOWNLOAD_SLOTS
+        'AUTOTHROTTLE_ENABLED': False,
+        'DOWNLOAD_SLOTS': DOWNLOAD_SLOTS,
+        'DOWNLOADER_MIDDLEWARES': {
+            'crawler.middlewares.RedirectSlotMiddleware': 543,
+            'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+            'crawler.httpcache.RevalidateCacheMiddleware': 900,
+        },
+    }
+
+    @property
+    def per_page(self):
+        return 1000 if self.mode == 'export' else 10  # API maximum
 
+    def search_url(self, start):
+        url = self.base_url + '&start=' + str(start)
+        if self.mode == 'export':
+            url += '&per_page=' + str(self.per_page)
+        return url
+
+    async def start(self):
+        yield scrapy.Request(self.search_url(0), dont_filter=True)
 
     def parse(self, response, start=0):
 
@@ -50,6 +90,16 @@ class HarvardSpider(scrapy.Spider, JsonLdMixin):
 
         for item in api_res['data']['items']:
 
+            if self.mode == 'export' and item.get('global_id'):
+                yield scrapy.Request(
+                    url=self.export_url + item['global_id'],
+                    callback=self.extract_export,
+                    cb_kwargs={
+                        '_id': item['url']
+                    }
+                )
+                continue
+
             yield scrapy.Request(
                 url=item['url'],
                 callback=self.extract_jsonld,
@@ -58,71 +108,117 @@ class HarvardSpider(scrapy.Spider, JsonLdMixin):
                 }
             )
 
-        logging.info('Requesting next page from item %s.', start + 10)
+        logging.info('Requesting next page from item %s.', start + self.per_page)
 
-        if len(api_res['data']['items']) == 10:
+        if len(api_res['data']['items']) == self.per_page:
             yield scrapy.Request(
-                url=self.base_url + '&start=' + str(start + 10),
+                url=self.search_url(start + self.per_page),
                 cb_kwargs={
-                    'start': start + 10
+                    'start': start + self.per_page
                 }
             )
         else:
             logging.info('No more data to crawl. Current start: %s.', start)
 
+    def extract_export(self, response, _id=None):
+        """
+        Scrapy Spider Request Callback Function
+        for the schema.org export of a dataset.
+        """
+        jsld = json.loads(response.body)
+        yield from self._with_ids(([jsld], False), response, _id)
+
 
 class HarvardTracingSpider(scrapy.Spider):
     """
     Resolve Redirections and Validate Links
 
     "createdAt": "2011-02-20T14:25:02Z" is used for sorting by date
+
+    * Links are traced with HEAD requests on Scrapy's downloader,
+      following redirects and recording each of them.
+    * Hosts in crawler.ratelimit.RATES, like dataverse.harvard.edu
+      and its declared Crawl-delay, get one request at a time at
+      their rate, redirects included, other hosts
+      CONCURRENT_REQUESTS_PER_DOMAIN.
+    * Traces are added to the crawl index of previous runs, see
+      ES_INDEX and recreate_index in crawler.pipelines.
+    * The start of the next page to trace is saved in the index
+      _meta once every link of the pages before it is traced
+      and its trace written to Elasticsearch.
     """
 
     name = 'harvard_tracing'
     base_url = 'https://dataverse.harvard.edu/api/search?q=*&type=dataset&sort=date&per_page=250&order=asc'
     client = elasticsearch.Elasticsearch(os.getenv('ES_HOST', 'localhost:9200'))
     step = 250
+    recreate_index = False
+
+    custom_settings = {
+        'AUTOTHROTTLE_ENABLED': False,
+        'CONCURRENT_REQUESTS': 32,
+        'CONCURRENT_REQUESTS_PER_DOMAIN': 8,
+        'DOWNLOAD_SLOTS': DOWNLOAD_SLOTS,
+        'DOWNLOADER_MIDDLEWARES': {
+            'crawler.middlewares.RedirectSlotMiddleware': 543,
+            'scrapy.downloadermiddlewares.httpcache.HttpCacheMiddleware': None,
+            'crawler.httpcache.RevalidateCacheMiddleware': 900,
+        },
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index = os.getenv('ES_INDEX', 'crawler_' + self.name)
+        self._untraced = {}  # page start: number of links not stored yet
+        self._pages = {}  # link: start of its page, until its trace is stored
+        self._saved = defer.succeed(None)  # checkpoint writes, in order
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider._stored, signal=item_indexed)
+        return spider
 
     def start_requests(self):
 
-        res = self.client.indices.get_mapping(index=self.name)
-        mapping = res[self.name]['mappings']
+        try:
+            res = self.client.indices.get_mapping(index=self.index)
+        except elasticsearch.NotFoundError:
+            res = {self.index: {'mappings': {}}}
+        # keyed by the index name, also when self.index is an alias
+        mapping = next(iter(res.values()))['mappings']
         next_start = mapping.get('_meta', {}).get('next_start', 0)
         url = self.base_url + '&start=' + str(next_start)
         return [scrapy.FormRequest(url, callback=self.parse, cb_kwargs={'start': next_start})]
 
+    async def start(self):
+        for request in self.start_requests():
+            yield request
+
     def parse(self, response, start=0):
 
         api_res = json.loads(response.body)
         assert api_res['status'] == 'OK'
         next_start = start + self.step
 
-        for item in api_res['data']['items']:
-            # skip already scrapped
-            if self.client.exists(index=self.name, id=item['url']):
-                logging.info('Skipping %s.', item['url'])
-                continue
-            try:
-                r = requests.head(item['url'], allow_redirects=True)
-                yield {
-                    "_id": item['url'],
-                    "success": True,
-                    "location": r.url,
-                    "status": r.status_code,
-                    "history": [{
-                        "url": item.url,
-                        "status": item.status_code
-                    } for item in r.history]
-                }
-            except Exception:
-                yield {
-                    "_id": item['url'],
-                    "success": False,
-                    "exception": str(Exception)
-                }
+        items = api_res['data']['items']
+        indexed = indexed_ids(self.client, self.index, [item['url'] for item in items])
+        if indexed:  # skip already scrapped
+            logging.info('Skipping %s links already traced.', len(indexed))
+        urls = list(dict.fromkeys(item['url'] for item in items if item['url'] not in indexed))
+
+        self._untraced[start] = len(urls)
+        for url in urls:
+            self._pages[url] = start
+            # item urls are DOIs redirecting to dataverse
+            yield scrapy.Request(
+                url, method='HEAD', callback=self.trace, errback=self.trace_failed,
+                cb_kwargs={'start': start}, priority=1, dont_filter=True,
+                # record error statuses, redirects are followed
+                meta={'handle_httpstatus_list': list(range(400, 600))})
+        self._checkpoint()
 
         logging.info('Requesting next page from item %s.', next_start)
-        self.client.indices.put_mapping(index=self.name, body={"_meta":{"next_start":next_start}})
 
         if api_res['data']['start'] <= api_res['data']['total_count']:
             yield scrapy.Request(
@@ -133,3 +229,56 @@ class HarvardTracingSpider(scrapy.Spider):
             )
         else:
             logging.info('No more data to crawl. Current start: %s.', start)
+
+    def trace(self, response, start):
+
+        redirects = zip(response.meta.get('redirect_urls', []), response.meta.get('redirect_reasons', []))
+        return {
+            "_id": response.meta.get('redirect_urls', [response.url])[0],
+            "success": True,
+            "location": response.url,
+            "status": response.status,
+            "history": [{
+                "url": url,
+                "status": status
+            } for url, status in redirects]
+        }
+
+    def trace_failed(self, failure):
+
+        request = failure.request
+        return {
+            "_id": request.meta.get('redirect_urls', [request.url])[0],
+            "success": False,
+            "exception": repr(failure.value)
+        }
+
+    def _stored(self, item, _id, spider):
+
+        if spider is self and _id in self._pages:
+            self._untraced[self._pages.pop(_id)] -= 1
+            self._checkpoint()
+
+    def _checkpoint(self):
+        """
+        Save the start of the first page with links not traced yet.
+        Pages are requested one after another, so in order here.
+        """
+        next_start = None
+        while self._untraced:
+            start, untraced = next(iter(self._untraced.items()))
+            if untraced:
+                break
+            del self._untraced[start]
+            next_start = start + self.step
+
+        if next_start is not None:
+            # off the reactor thread, one after another
+            body = {"_meta": {"next_start": next_start}}
+            self._saved.addCallback(lambda _: threads.deferToThread(
+                self.client.indices.put_mapping, index=self.index, body=body))
+            self._saved.addErrback(lambda failure: logging.error(
+                'Failed to save next start %s: %s', next_start, failure.getErrorMessage()))
+
+    def closed(self, reason):
+        return self._saved
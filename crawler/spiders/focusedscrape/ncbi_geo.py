@@ -11,46 +11,194 @@
 
 '''
 
+import json
+import logging
+import os
+from urllib.parse import urlencode
+
 import scrapy
+from elasticsearch import Elasticsearch, NotFoundError
+from scrapy.selector import Selector
+
+from crawler.offload import offloaded
+from crawler.ratelimit import download_slots
+from crawler.signals import item_indexed
+
+
+def parse_series(body):
+    """
+    Scrape the series table of an accession page.
+    Runs in the parse pool, see crawler.offload.
+    """
+    table = Selector(body=body, type='html').xpath(
+        '/html/body/table/tr/td/table[6]/tr[3]/td[2]'
+        '/table/tr/td/table/tr/td/table[2]/tr/td'
+        '/table[1]/tr')
+    data = {}
+
+    for node in table:
+        # extract series id
+        if node.attrib.get('bgcolor') == '#cccccc':
+            data['_id'] = node.xpath('.//strong').attrib.get('id')
+        # remove place holder lines
+        elif len(node.xpath('./td')) == 2:
+            if node.xpath('string(./td[1])').get().strip():
+                # extract multi item entry
+                if node.xpath('./td[2]').attrib.get('onmouseout'):
+                    key = node.xpath('./td[1]/text()').get().split()[0]
+                    data[key] = node.xpath('./td[2]//a/text()').getall()
+                # extract single item entry
+                else:
+                    key = node.xpath('./td[1]/text()').get()
+                    data[key] = node.xpath('string(./td[2])').get().strip().replace('\xa0', ' ')
+
+    return data
 
 
 class NCBIGeoSpider(scrapy.Spider):
+    """
+    Series accessions are discovered with E-utilities esearch
+    on the gds database, 10000 per request, instead of trying
+    every accession number up to a fixed one.
+
+    * With -a mode=new, only accessions above the highest one
+      crawled by previous runs are requested, and the items are
+      added to the crawl index instead of recreating it.
+    * The highest accession below which every accession was
+      scraped and written to Elasticsearch is kept in the _meta
+      of the crawl index, see ES_INDEX in crawler.pipelines.
+      Pages without a series table, like error pages, hold it
+      back until they are scraped by a later run.
+    * Requests to NCBI are spaced out at the rates of
+      crawler.ratelimit, set Env API_KEY for E-utilities.
+    """
 
     name = 'ncbi_geo'
-
-    def start_requests(self):
-
-        start = 1
-        end = 137890
-        prefix = "https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=GSE"
-        for acc_id in range(start, end + 1):
-            yield scrapy.Request(url=prefix + str(acc_id))
-
-    def parse(self, response):
-
-        table = response.xpath(
-            '/html/body/table/tr/td/table[6]/tr[3]/td[2]'
-            '/table/tr/td/table/tr/td/table[2]/tr/td'
-            '/table[1]/tr')
-        data = {}
-
-        for node in table:
-            # extract series id
-            if node.attrib.get('bgcolor') == '#cccccc':
-                data['_id'] = node.xpath('.//strong').attrib.get('id')
-            # remove place holder lines
-            elif len(node.xpath('./td')) == 2:
-                if node.xpath('string(./td[1])').get().strip():
-                    # extract multi item entry
-                    if node.xpath('./td[2]').attrib.get('onmouseout'):
-                        key = node.xpath('./td[1]/text()').get().split()[0]
-                        data[key] = node.xpath('./td[2]//a/text()').getall()
-                    # extract single item entry
-                    else:
-                        key = node.xpath('./td[1]/text()').get()
-                        data[key] = node.xpath('string(./td[2])').get().strip().replace('\xa0', ' ')
-
-        return data if data else None
+    esearch_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?'
+    series_url = 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=GSE'
+    client = Elasticsearch(os.getenv('ES_HOST', 'localhost:9200'))
+    mode = 'all'  # or 'new'
+    retmax = 10000  # esearch maximum
+
+    # gds UIDs of series are their accession number plus this
+    SERIES_UID = 200000000
+
+    custom_settings = {
+        # AutoThrottle would replace the delays of DOWNLOAD_SLOTS
+        'AUTOTHROTTLE_ENABLED': False,
+        'DOWNLOAD_SLOTS': download_slots(),
+        'PARSE_WORKERS': 4,
+        # downloads outpace the bulk writes of a full crawl
+        'ES_BACKPRESSURE_ENABLED': True,
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.index = os.getenv('ES_INDEX', 'crawler_' + self.name)
+        self.newer_than = 0
+        self._discovered = False  # every esearch page was read
+        self._pending = set()  # accessions requested, not stored yet
+        self._items = {}  # series _id: accession, until stored
+        self._done = []  # accessions stored
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider._stored, signal=item_indexed)
+        return spider
+
+    @property
+    def recreate_index(self):
+        return self.mode != 'new'
+
+    def esearch(self, retstart=0):
+
+        params = {
+            'db': 'gds',
+            'term': 'GSE[ETYP]',
+            'retmode': 'json',
+            'retstart': retstart,
+            'retmax': self.retmax,
+        }
+        if os.getenv('API_KEY'):
+            params['api_key'] = os.getenv('API_KEY')
+        return scrapy.Request(
+            self.esearch_url + urlencode(params), callback=self.parse_esearch,
+            cb_kwargs={'retstart': retstart}, priority=-1, dont_filter=True)
+
+    async def start(self):
+
+        if self.mode == 'new':
+            self.newer_than = self._get_meta().get('highest_accession', 0)
+            logging.info('Requesting accessions above GSE%s.', self.newer_than)
+        yield self.esearch()
+
+    def parse_esearch(self, response, retstart=0):
+
+        result = json.loads(response.body)['esearchresult']
+        count = int(result['count'])
+
+        skipped = 0
+        for uid in result['idlist']:
+            acc_id = int(uid) - self.SERIES_UID
+            if not 0 < acc_id < self.SERIES_UID or acc_id <= self.newer_than:
+                skipped += 1
+                continue
+            self._pending.add(acc_id)
+            yield scrapy.Request(url=self.series_url + str(acc_id), cb_kwargs={'acc_id': acc_id})
+        self.crawler.stats.inc_value('geo/discovered', len(result['idlist']) - skipped)
+
+        retstart += len(result['idlist'])
+        logging.info('Discovered %s of %s accessions.', retstart, count)
+        if result['idlist'] and retstart < count:
+            yield self.esearch(retstart)
+        else:
+            self._discovered = True
+
+    @offloaded(parse_series)
+    def parse(self, response, data, acc_id=0):
+
+        if not data:
+            logging.warning('No series table in %s.', response.url)
+            self.crawler.stats.inc_value('geo/empty')
+            return None
+        if data.get('_id'):
+            self._items[data['_id']] = acc_id
+        return data
+
+    def _stored(self, item, _id, spider):
+
+        if spider is self and _id in self._items:
+            acc_id = self._items.pop(_id)
+            self._pending.discard(acc_id)
+            self._done.append(acc_id)
+
+    def closed(self, reason):
+
+        # accessions not discovered were neither requested nor scraped
+        if not self._discovered:
+            logging.info('Not saving the highest accession after an incomplete esearch.')
+            return
+        # those that failed, were empty or not stored are still pending
+        lowest = min(self._pending, default=self.SERIES_UID)
+        highest = max((acc_id for acc_id in self._done if acc_id < lowest), default=0)
+        if highest > self.newer_than:
+            meta = self._get_meta()
+            meta['highest_accession'] = highest
+            try:
+                self.client.indices.put_mapping(index=self.index, body={'_meta': meta})
+            except NotFoundError:
+                logging.warning('No index %s to save the highest accession in.', self.index)
+                return
+            logging.info('Scraped every accession up to GSE%s.', highest)
+
+    def _get_meta(self):
+        try:
+            res = self.client.indices.get_mapping(index=self.index)
+        except NotFoundError:
+            return {}
+        # keyed by the index name, also when self.index is an alias
+        return next(iter(res.values()))['mappings'].get('_meta', {})
 
 
 def main():
@@ -23,46 +23,65 @@ import logging
 
 from scrapy import Request, Spider
 
+from crawler.offload import offloaded
+
 from ..helper import JsonLdMixin
 
 
+def record_links(body):
+    """
+    Read the DOI links of a page of records, and the next page.
+    Runs in the parse pool, see crawler.offload, which sends
+    back these few links instead of the whole decoded page.
+    """
+    res_doc = json.loads(body)
+    links, errors = [], []
+    for hit in res_doc['hits']['hits']:
+        try:
+            links.append((hit.get('doi'), hit['links']['doi']))
+        except KeyError:
+            errors.append(hit)
+    return links, errors, res_doc.get('links', {}).get('next')
+
+
 class ZenodoCovidSpider(Spider, JsonLdMixin):
 
     name = 'zenodo_covid'
     start_urls = ['https://zenodo.org/api/records/?page=1&size=1000&communities=covid-19']
+    jsonld_offload = True
+
+    custom_settings = {
+        'PARSE_WORKERS': 4,
+    }
 
-    def parse(self, response):
+    @offloaded(record_links)
+    def parse(self, response, records):
 
-        res_doc = json.loads(response.body)
-        hits = res_doc['hits']['hits']
-        total = len(hits)
+        links, errors, next_page = records
+        total = len(links)
 
-        for index, hit in enumerate(hits):
+        for hit in errors:
+            yield {
+                "_type": "error",
+                "_document": hit
+            }
 
-            logging.info('[%s/%s] %s', index + 1, total, hit.get('doi'))
+        for index, (doi, url) in enumerate(links):
 
-            try:
-                url = hit['links']['doi']
+            logging.info('[%s/%s] %s', index + 1, total, doi)
 
-            except KeyError:
-                yield {
-                    "_type": "error",
-                    "_document": hit
+            yield Request(
+                url=url,
+                callback=self.extract_jsonld,
+                cb_kwargs={
+                    '_id': url
                 }
-            else:
-                yield Request(
-                    url=url,
-                    callback=self.extract_jsonld,
-                    cb_kwargs={
-                        '_id': url
-                    }
-                )
+            )
 
         # follow next page
-        try:
-            next_page = res_doc['links']['next']
+        if next_page:
             logging.info('next page: %s', next_page)
             yield response.follow(next_page)
-        except KeyError:
+        else:
             logging.info('no more pages.')
             return None
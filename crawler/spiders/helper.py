@@ -1,8 +1,97 @@
 """ Scrapy Spider Mixins """
 
+import json
 import logging
+import re
 
+import extruct
+from elasticsearch.helpers import streaming_bulk
 from extruct.jsonld import JsonLdExtractor
+from extruct.utils import parse_xmldom_html
+
+from crawler.offload import offload
+
+# script blocks and comments, whichever comes first,
+# so that a script inside a comment or inside another
+# script's text is skipped as an HTML parser would.
+_SCRIPT_OR_COMMENT = re.compile(
+    rb'<!--.*?-->|<script\b([^>]*)>(.*?)</script\s*>', re.IGNORECASE | re.DOTALL)
+# attribute names are case-insensitive in HTML, but extruct
+# matches the value exactly, @type="application/ld+json"
+_JSONLD_TYPE = re.compile(
+    rb'''\s(?i:type)\s*=\s*(?:"application/ld\+json"|'application/ld\+json'|application/ld\+json(?=[\s/]|$))''')
+
+_jsonld_extractor = JsonLdExtractor()
+
+
+def scan_jsonld(body, encoding='utf-8'):
+    """
+    Extract JSON-LD items by scanning the raw page for
+    <script type="application/ld+json"> blocks and decoding them,
+    without parsing the page into a DOM.
+
+    Return None when the markup is not plain enough to be sure the
+    result matches a full HTML parse, so that the caller can fall back.
+    """
+    items = []
+    mentions = 0  # of the JSON-LD type in the blocks scanned
+    for match in _SCRIPT_OR_COMMENT.finditer(body):
+        mentions += match.group(0).lower().count(b'application/ld+json')
+        attrs, script = match.groups()
+        if attrs is None or not _JSONLD_TYPE.search(attrs):
+            continue  # a comment or another kind of script
+        if b'<!--' in script or b'<script' in script.lower():
+            return None
+        try:
+            data = json.loads(script.decode(encoding), strict=False)
+        except ValueError:  # including decoding errors
+            return None
+        if isinstance(data, dict):
+            data = [data]
+        if isinstance(data, list):
+            items.extend(item for item in data if item)
+    if mentions != body.lower().count(b'application/ld+json'):
+        return None  # like an unclosed script block
+    return items
+
+
+def jsonld_items(body, fast=True):
+    """
+    Extract JSON-LD items from a page, scanning it first if fast.
+    Return the items and whether the page had to be parsed in full.
+    """
+    items = scan_jsonld(body) if fast else None
+    if items is not None:
+        return items, False
+    return _jsonld_extractor.extract(body), fast
+
+
+def indexed_ids(client, index, ids):
+    """
+    Return the subset of ids already indexed in Elasticsearch,
+    with one multi-get request instead of one request per id.
+    """
+    ids = [str(_id) for _id in ids]
+    if not ids:
+        return set()
+    res = client.mget(index=index, body={'ids': ids}, _source=False)
+    return {doc['_id'] for doc in res['docs'] if doc.get('found')}
+
+
+def delete_ids(client, index, ids):
+    """
+    Delete documents by id with bulk requests,
+    return the number of those that were found.
+    """
+    actions = ({'_op_type': 'delete', '_index': index, '_id': str(_id)} for _id in ids)
+    deleted = 0
+    for ok, result in streaming_bulk(
+            client, actions, raise_on_error=False, raise_on_exception=False):
+        if ok:
+            deleted += 1
+        elif result.get('delete', {}).get('status') != 404:
+            logging.error('Failed to delete: %s', result)
+    return deleted
 
 
 class JsonLdMixin:
@@ -25,8 +114,18 @@ class JsonLdMixin:
                     cb_kwargs={
                         '_id': uuid.uuid1() # optional
                     })
+
+    Pages are scanned for JSON-LD blocks without building a DOM.
+    Set jsonld_fast to False to always parse pages with extruct.
+
+    Set jsonld_offload to True to extract in the parse pool,
+    see crawler.offload. extract_jsonld then returns a coroutine,
+    so it can only be used as a callback, not iterated over.
     """
 
+    jsonld_fast = True
+    jsonld_offload = False
+
     def extract_jsonld(self, response, _id=None):
         """
         Scrapy Spider Request Callback Function
@@ -35,8 +134,20 @@ class JsonLdMixin:
         * Use response URL as default _id
 
         """
+        if self.jsonld_offload:
+            return self._extract_jsonld_offloaded(response, _id)
+        return self._with_ids(jsonld_items(response.body, self.jsonld_fast), response, _id)
 
-        jslds = JsonLdExtractor().extract(response.body)
+    async def _extract_jsonld_offloaded(self, response, _id=None):
+        extracted = await offload(jsonld_items, response.body, self.jsonld_fast)
+        return list(self._with_ids(extracted, response, _id))
+
+    def _with_ids(self, extracted, response, _id):
+
+        jslds, fallback = extracted
+        if fallback:
+            logging.debug('Parsed %s in full for JSON-LD.', response.url)
+            self._inc_stats('jsonld/fallback')
 
         for jsld in jslds:
             if _id:
@@ -48,3 +159,75 @@ class JsonLdMixin:
             yield jsld
 
     parse = extract_jsonld  # Set as the default parsing method
+
+    def _inc_stats(self, key):
+        crawler = getattr(self, 'crawler', None)
+        if crawler is not None:
+            crawler.stats.inc_value(key)
+
+
+class StructuredDataMixin(JsonLdMixin):
+    """
+    Scrapy Spider Mixin Class to Extract Structured Metadata
+    in the syntaxes listed in metadata_syntaxes.
+
+    Each page is parsed once and every syntax is extracted from
+    the same tree. Without RDFa, that is the tree Scrapy builds
+    for response.xpath, so link extraction shares it as well.
+    RDFa requires a tree that keeps namespace declarations,
+    which is parsed separately when it is selected.
+
+    JSON-LD and Microdata items are normalized to schema.org
+    style dictionaries with @context and @type, see extruct's
+    uniform option. RDFa items are not: they are expanded
+    JSON-LD, with full IRIs as keys and blank node @ids that
+    change on every crawl, so only select RDFa for spiders
+    whose items are processed accordingly downstream.
+
+    Example:
+
+    class MetadataSpider(StructuredDataMixin, scrapy.Spider):
+
+        name = 'SPIDER_NAME'
+        metadata_syntaxes = ('json-ld', 'microdata')
+    """
+
+    metadata_syntaxes = ('json-ld', 'microdata')
+
+    def extract_metadata(self, response, _id=None):
+        """
+        Scrapy Spider Request Callback Function
+
+        * Inject an _id field for database pipeline
+        * Use response URL as default _id
+        * Suffix the _id of further items from the page with #1, #2...
+
+        """
+        syntaxes = list(self.metadata_syntaxes)
+        if syntaxes == ['json-ld'] and not self.jsonld_offload:  # no tree needed
+            yield from self.extract_jsonld(response, _id)
+            return
+
+        if 'rdfa' in syntaxes:
+            tree = parse_xmldom_html(response.body, response.encoding)
+        else:
+            tree = response.selector.root
+
+        extracted = extruct.extract(
+            tree, base_url=response.url, syntaxes=syntaxes,
+            uniform=True, errors='log')
+
+        _id = _id or response.url
+        count = 0
+        for syntax in syntaxes:
+            for item in extracted.get(syntax, ()):
+                if not isinstance(item, dict) or '@type' not in item:
+                    continue  # like RDFa vocabulary statements
+                # items after the first would overwrite it in the index
+                item['_id'] = f'{_id}#{count}' if count else _id
+                count += 1
+                self._inc_stats(f'metadata/{syntax}')
+                logging.debug(item)
+                yield item
+
+    parse = extract_metadata  # Set as the default parsing method
@@ -0,0 +1,437 @@
+""" Incremental Sitemap Spider """
+
+import collections
+import gzip
+import inspect
+import io
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from itertools import islice
+
+from elasticsearch import Elasticsearch
+from lxml import etree
+from scrapy import Request
+from scrapy.http import XmlResponse
+from scrapy.spiders import SitemapSpider
+from scrapy.utils.gz import gzip_magic_number
+from scrapy.utils.misc import arg_to_iter
+from scrapy.utils.project import data_path
+from scrapy.utils.sitemap import sitemap_urls_from_robots
+
+from crawler.signals import item_indexed
+
+from .helper import delete_ids
+
+
+class SitemapStream:
+    """
+    Entries of a sitemap read incrementally from a file object.
+    Each entry is a dictionary like those of scrapy's Sitemap.
+    The type is known once the first entry has been read,
+    or once the sitemap has been read if it has no entries.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.type = None  # 'urlset' or 'sitemapindex'
+
+    def __iter__(self):
+
+        events = etree.iterparse(
+            self.file, events=('end',), tag=('{*}url', '{*}sitemap'),
+            recover=True, resolve_entities=False, no_network=True, huge_tree=True)
+        for _, elem in events:
+            parent = elem.getparent()
+            if parent is None or parent.getparent() is not None:
+                continue  # only entries directly under the root
+            self.type = 'urlset' if etree.QName(elem).localname == 'url' else 'sitemapindex'
+            entry = {}
+            for child in elem:
+                name = etree.QName(child).localname
+                if name == 'link':
+                    if 'href' in child.attrib:
+                        entry.setdefault('alternate', []).append(child.get('href').strip())
+                elif child.text:
+                    entry[name] = child.text.strip()
+            # drop what has been read
+            elem.clear()
+            while elem.getprevious() is not None:
+                del parent[0]
+            if 'loc' in entry:
+                yield entry
+
+        if self.type is None and events.root is not None:
+            name = etree.QName(events.root).localname
+            if name in ('urlset', 'sitemapindex'):
+                self.type = name
+
+
+def iter_sitemap(file):
+    return SitemapStream(file)
+
+
+class _SizeLimitedReader:
+    """
+    Stop decompressing past max_size bytes, like scrapy does for sitemaps.
+    """
+
+    def __init__(self, file, max_size):
+        self.file = file
+        self.max_size = max_size
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.file.read(size)
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            raise ValueError(f'Sitemap larger than {self.max_size} bytes after decompression.')
+        return data
+
+
+def _parse_lastmod(lastmod):
+    try:
+        parsed = datetime.fromisoformat(lastmod.strip().replace('Z', '+00:00'))
+    except (AttributeError, ValueError):
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
+def is_newer(lastmod, previous):
+    """
+    Tell if a sitemap <lastmod> moved forward, True when unknown.
+    """
+    if not lastmod or not previous:
+        return True
+    new, old = _parse_lastmod(lastmod), _parse_lastmod(previous)
+    if new is None or old is None:
+        return lastmod != previous
+    return new > old
+
+
+class SitemapState:
+    """
+    The <lastmod> of every page and child sitemap found in previous
+    runs of a spider, and the last run each of them was found in.
+    """
+
+    def __init__(self, path):
+
+        self.conn = sqlite3.connect(path)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS urls (loc TEXT PRIMARY KEY, lastmod TEXT, sitemap TEXT, run INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS urls_sitemap ON urls (sitemap)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS sitemaps (loc TEXT PRIMARY KEY, lastmod TEXT, run INTEGER)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS runs (run INTEGER PRIMARY KEY, started REAL, finished REAL)')
+        with self.conn:
+            self.run = self.conn.execute('INSERT INTO runs (started) VALUES (?)', (time.time(),)).lastrowid
+
+    def lastmods(self, table, locs):
+        found = {}
+        for start in range(0, len(locs), 500):  # SQLite limits query variables
+            chunk = locs[start:start + 500]
+            found.update(self.conn.execute(
+                f"SELECT loc, lastmod FROM {table} WHERE loc IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall())
+        return found
+
+    def update_urls(self, sitemap, entries):
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)',
+                [(loc, lastmod, sitemap, self.run) for loc, lastmod in entries])
+
+    def update_url(self, loc, lastmod):
+        with self.conn:
+            self.conn.execute('UPDATE urls SET lastmod = ? WHERE loc = ?', (lastmod, loc))
+
+    def fail_url(self, loc):
+        """
+        Make sure a page that could not be downloaded is requested next time,
+        including the sitemap it is listed in.
+        """
+        with self.conn:
+            self.conn.execute(
+                'UPDATE sitemaps SET lastmod = NULL WHERE loc = (SELECT sitemap FROM urls WHERE loc = ?)', (loc,))
+
+    def update_sitemap(self, loc, lastmod):
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO sitemaps VALUES (?, ?, ?)', (loc, lastmod, self.run))
+
+    def keep_sitemap(self, loc):
+        """
+        Record that an unchanged child sitemap and its pages are still listed.
+        Return the number of its pages, 0 if it is a sitemap index.
+        """
+        with self.conn:
+            self.conn.execute('UPDATE sitemaps SET run = ? WHERE loc = ?', (self.run, loc))
+            return self.conn.execute('UPDATE urls SET run = ? WHERE sitemap = ?', (self.run, loc)).rowcount
+
+    def finish(self):
+        """
+        Forget and return the pages not found in this run.
+        """
+        with self.conn:
+            removed = [loc for loc, in self.conn.execute('SELECT loc FROM urls WHERE run < ?', (self.run,))]
+            self.conn.execute('DELETE FROM urls WHERE run < ?', (self.run,))
+            self.conn.execute('DELETE FROM sitemaps WHERE run < ?', (self.run,))
+            self.conn.execute('UPDATE runs SET finished = ? WHERE run = ?', (time.time(), self.run))
+        return removed
+
+    def close(self):
+        self.conn.close()
+
+
+class IncrementalSitemapSpider(SitemapSpider):
+    """
+    Sitemap Spider that only requests pages new since its last run,
+    or whose <lastmod> moved forward.
+
+    * The <lastmod> of every page is kept in a SQLite file per spider
+      in the directory of the setting SITEMAP_STATE_DIR.
+    * Child sitemaps of an index whose <lastmod> did not move forward
+      are not downloaded again, their pages are assumed unchanged.
+    * Pages without <lastmod> are always requested, through the
+      HTTP cache, so that unchanged ones are answered with a 304.
+    * Items of a page are indexed under its sitemap <loc>, also
+      when the page was redirected.
+    * A new <lastmod> is saved once the item of the page is written
+      to Elasticsearch, or once its callback returned if it has no
+      item under its <loc>. Pages that fail are requested again
+      with their sitemap next time.
+    * Sitemaps are decompressed and parsed incrementally, requests
+      are scheduled as entries are read, and at most SITEMAP_CONCURRENCY
+      sitemaps are downloaded or read at a time.
+    * Pages are added to the crawl index of previous runs, which is
+      not recreated, see recreate_index in crawler.pipelines.
+    * After a run where every sitemap was read, pages no longer listed
+      are deleted from the crawl index, where they are found under
+      their URL, and written to <name>.removed.txt next to the state,
+      one URL per line, so that they can be deleted downstream.
+
+    Example:
+
+    class RecordSpider(IncrementalSitemapSpider, JsonLdMixin):
+
+        name = 'SPIDER_NAME'
+        sitemap_urls = ['https://example.org/sitemap.xml']
+        sitemap_rules = [('/record/', 'extract_jsonld')]
+    """
+
+    sitemap_state = None
+    recreate_index = False
+
+    custom_settings = {
+        # pages without <lastmod> are revalidated, see crawler.httpcache
+        'HTTPCACHE_ENABLED': True,
+    }
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        state_dir = data_path(crawler.settings.get('SITEMAP_STATE_DIR', 'sitemaps'), createdir=True)
+        spider.sitemap_state_dir = state_dir
+        spider.sitemap_state = SitemapState(os.path.join(state_dir, f'{spider.name}.sqlite'))
+        spider.sitemap_concurrency = crawler.settings.getint('SITEMAP_CONCURRENCY', 2)
+        spider._sitemaps_queued = collections.deque()  # (url, lastmod)
+        spider._sitemaps_seen = set()
+        spider._sitemaps_in_flight = 0
+        spider._sitemap_errors = 0
+        spider._unindexed = {}  # loc: lastmod of pages with items not written yet
+        crawler.signals.connect(spider._item_indexed, signal=item_indexed)
+        return spider
+
+    def start_requests(self):
+        self._queue_sitemaps((url, None) for url in self.sitemap_urls)
+        return self._release_sitemaps()
+
+    async def start(self):
+        for request in self.start_requests():
+            yield request
+
+    def _queue_sitemaps(self, sitemaps):
+        for url, lastmod in sitemaps:
+            # a duplicate request would be dropped without a callback
+            if url not in self._sitemaps_seen:
+                self._sitemaps_seen.add(url)
+                self._sitemaps_queued.append((url, lastmod))
+
+    def _release_sitemaps(self):
+        """
+        Request queued sitemaps while fewer than SITEMAP_CONCURRENCY are
+        being downloaded or read, so that pages of one sitemap are
+        scheduled before the next sitemap is taken on.
+        """
+        while self._sitemaps_queued and self._sitemaps_in_flight < self.sitemap_concurrency:
+            url, lastmod = self._sitemaps_queued.popleft()
+            self._sitemaps_in_flight += 1
+            yield Request(
+                url, callback=self._parse_sitemap, errback=self._sitemap_failed,
+                cb_kwargs={'lastmod': lastmod}, priority=-1)
+
+    def _sitemap_failed(self, failure):
+        self._sitemap_errors += 1
+        self._sitemaps_in_flight -= 1
+        logging.error('Failed to download sitemap %s: %s',
+                      failure.request.url, failure.getErrorMessage())
+        return list(self._release_sitemaps())
+
+    def _parse_sitemap(self, response, lastmod=None):
+
+        try:
+            if response.url.endswith('/robots.txt'):
+                self._queue_sitemaps(
+                    (url, None) for url in sitemap_urls_from_robots(response.body, base_url=response.url))
+            else:
+                yield from self._read_sitemap(response, lastmod)
+        except Exception as exc:  # keep reading the other sitemaps
+            self._sitemap_errors += 1
+            logging.error('Failed to read sitemap %s: %s', response.url, exc)
+
+        self._sitemaps_in_flight -= 1
+        yield from self._release_sitemaps()
+
+    def _read_sitemap(self, response, lastmod):
+
+        stream = self._sitemap_stream(response)
+        sitemap = iter_sitemap(stream) if stream else None
+        entries = self.sitemap_filter(sitemap) if sitemap else ()
+
+        for batch in iter(lambda: list(islice(entries, 1000)), []):
+            if sitemap.type == 'sitemapindex':
+                self._follow_sitemaps(batch)
+            else:
+                yield from self._request_pages(response.url, batch)
+
+        if sitemap is None or sitemap.type is None:
+            self._sitemap_errors += 1
+            logging.warning('Ignoring invalid sitemap: %s', response)
+            return
+        # read completely, so that a child sitemap can be skipped next time
+        self.sitemap_state.update_sitemap(response.url, lastmod)
+
+    def _sitemap_stream(self, response):
+        """
+        Return the sitemap in the response as a file object,
+        decompressed on the fly, or None if it is not a sitemap.
+        """
+        if gzip_magic_number(response):
+            max_size = response.meta.get('download_maxsize', self._max_size)
+            return _SizeLimitedReader(gzip.GzipFile(fileobj=io.BytesIO(response.body)), max_size)
+        # gzipped sitemaps served with Content-Encoding: gzip
+        # are already decompressed by HttpCompressionMiddleware
+        if isinstance(response, XmlResponse) or response.url.endswith(('.xml', '.xml.gz')):
+            return io.BytesIO(response.body)
+        return None
+
+    def _follow_sitemaps(self, entries):
+
+        entries = [entry for entry in entries if any(x.search(entry['loc']) for x in self._follow)]
+        previous = self.sitemap_state.lastmods('sitemaps', [entry['loc'] for entry in entries])
+
+        for entry in entries:
+            loc, lastmod = entry['loc'], entry.get('lastmod')
+            # nested indexes are read again to know what they list
+            if loc in previous and lastmod and not is_newer(lastmod, previous[loc]) \
+                    and self.sitemap_state.keep_sitemap(loc):
+                self.crawler.stats.inc_value('sitemap/sitemaps_unchanged')
+                continue
+            self._queue_sitemaps([(loc, lastmod)])
+
+    def _request_pages(self, sitemap, entries):
+
+        pages = []  # (loc, lastmod, callback)
+        for entry in entries:
+            locs = [entry['loc']]
+            if self.sitemap_alternate_links:
+                locs += entry.get('alternate', [])
+            for loc in locs:
+                for regex, callback in self._cbs:
+                    if regex.search(loc):
+                        pages.append((loc, entry.get('lastmod'), callback))
+                        break
+
+        previous = self.sitemap_state.lastmods('urls', [loc for loc, _, _ in pages])
+        # a new lastmod is saved once its page is downloaded
+        self.sitemap_state.update_urls(sitemap, [(loc, previous.get(loc)) for loc, _, _ in pages])
+
+        for loc, lastmod, callback in pages:
+            if loc in previous and not is_newer(lastmod, previous[loc]):
+                self.crawler.stats.inc_value('sitemap/unchanged')
+                continue
+            self.crawler.stats.inc_value('sitemap/new' if loc not in previous else 'sitemap/changed')
+            yield Request(
+                loc, callback=self._parse_page, errback=self._page_failed,
+                cb_kwargs={'callback': callback.__name__},
+                meta={'sitemap_loc': loc, 'sitemap_lastmod': lastmod})
+
+    async def _parse_page(self, response, callback):
+        """
+        Run the callback of a page, with the items that
+        have the page URL as _id under its sitemap <loc>.
+        """
+        loc, lastmod = response.meta['sitemap_loc'], response.meta['sitemap_lastmod']
+        if response.status != 200:
+            self.sitemap_state.fail_url(loc)
+        stored = False  # an item under loc is to be written
+        try:
+            results = getattr(self, callback)(response)
+            if inspect.isawaitable(results):
+                results = await results
+            if hasattr(results, '__aiter__'):
+                results = [result async for result in results]
+            for result in arg_to_iter(results):
+                if isinstance(result, dict) and isinstance(result.get('_id'), str):
+                    _id = result['_id']
+                    # further items of the page are suffixed with #1, #2...
+                    if _id == response.url or _id.startswith(response.url + '#'):
+                        result['_id'] = _id = loc + _id[len(response.url):]
+                    stored = stored or _id == loc
+                yield result
+        except Exception:
+            self.sitemap_state.fail_url(loc)
+            raise
+
+        if response.status != 200:
+            return
+        if stored:
+            self._unindexed[loc] = lastmod
+        else:
+            self.sitemap_state.update_url(loc, lastmod)
+
+    def _item_indexed(self, item, _id, spider):
+
+        if spider is self and _id in self._unindexed:
+            self.sitemap_state.update_url(_id, self._unindexed.pop(_id))
+
+    def _page_failed(self, failure):
+        self.sitemap_state.fail_url(failure.request.meta['sitemap_loc'])
+        logging.error('Failed to download %s: %s', failure.request.url, failure.getErrorMessage())
+
+    def closed(self, reason):
+
+        # items not written, their pages are requested again next time
+        for loc in self._unindexed:
+            self.sitemap_state.fail_url(loc)
+
+        removed = []
+        if reason == 'finished' and not self._sitemap_errors:
+            removed = self.sitemap_state.finish()
+            self.crawler.stats.set_value('sitemap/removed', len(removed))
+            path = os.path.join(self.sitemap_state_dir, f'{self.name}.removed.txt')
+            with open(path, 'w') as file:
+                file.writelines(loc + '\n' for loc in removed)
+            logging.info('%s pages no longer in the sitemaps, listed in %s.', len(removed), path)
+        else:
+            logging.info('Not looking for removed pages after an incomplete run.')
+        self.sitemap_state.close()
+
+        if removed:  # still listed in the file if Elasticsearch fails
+            index = os.getenv('ES_INDEX', 'crawler_' + self.name)
+            client = Elasticsearch(os.getenv('ES_HOST', 'localhost:9200'))
+            deleted = delete_ids(client, index, removed)
+            logging.info('Deleted %s of them from %s.', deleted, index)
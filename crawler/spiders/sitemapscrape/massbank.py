@@ -1,9 +1,8 @@
-from scrapy.spiders import SitemapSpider
-
 from ..helper import JsonLdMixin
+from ..sitemap import IncrementalSitemapSpider
 
 
-class MassBankSpider(SitemapSpider, JsonLdMixin):
+class MassBankSpider(IncrementalSitemapSpider, JsonLdMixin):
     name = 'massbank'
     # have sitemap at https://massbank.eu/MassBank/sitemapindex.xml
     # prefer robots.txt
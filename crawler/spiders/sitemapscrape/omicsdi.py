@@ -16,12 +16,11 @@
         Sitemap: https://www.omicsdi.org/sitemap.xml
 
 """
-from scrapy.spiders import SitemapSpider
-
 from ..helper import JsonLdMixin
+from ..sitemap import IncrementalSitemapSpider
 
 
-class OmicsdiSpider(SitemapSpider, JsonLdMixin):
+class OmicsdiSpider(IncrementalSitemapSpider, JsonLdMixin):
 
     name = 'omicsdi'
 
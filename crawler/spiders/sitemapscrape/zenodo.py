@@ -6,12 +6,11 @@
 
 """
 
-from scrapy.spiders import SitemapSpider
-
 from ..helper import JsonLdMixin
+from ..sitemap import IncrementalSitemapSpider
 
 
-class ZenodoSpider(SitemapSpider, JsonLdMixin):
+class ZenodoSpider(IncrementalSitemapSpider, JsonLdMixin):
 
     name = 'zenodo'
     sitemap_urls = ['http://www.zenodo.org/sitemap.xml']
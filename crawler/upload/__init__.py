@@ -8,21 +8,87 @@ To make the crawled items searchable and aggregatable, reindexing is necessary.
 
 """
 
+import collections
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+import hashlib
+import importlib
+from importlib import metadata
+from itertools import chain
+import json
 import logging
+import multiprocessing
 import os
+import threading
 from typing import Union
 
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import reindex, scan
+from elasticsearch import Elasticsearch, NotFoundError
+from elasticsearch.helpers import parallel_bulk, reindex, scan, streaming_bulk
 
+from . import stages
 from .tdoc import TransformDoc
 
 
-uploaders = {
-    # 'default': <class crawler.upload.CrawlerESUploader>,
-    # 'dataset': <class crawler.upload.CrawlerDatasetESUploader>
-}
+class UploaderRegistry(Mapping):
+    """
+    Uploader classes by name, imported when first looked up.
+
+    Uploaders defined in this package are listed in MODULES.
+    Other packages can provide uploaders with an entry point
+    in the ENTRY_POINTS group, for example in setup.cfg:
+
+        [options.entry_points]
+        biothings.crawler.uploaders =
+            my_source = my_package.upload:MySourceUploader
+
+    Uploader classes register themselves when they are defined.
+    """
+
+    ENTRY_POINTS = 'biothings.crawler.uploaders'
+    MODULES = {
+        'zenodo_covid': 'crawler.upload.zenodo_covid',
+        'immport': 'crawler.upload.immport',
+        'immport_covid': 'crawler.upload.immport_covid',
+        'ncbi_geo': 'crawler.upload.ncbi_geo',
+    }
+
+    def __init__(self):
+        self._classes = {
+            # 'default': <class crawler.upload.CrawlerESUploader>,
+            # 'dataset': <class crawler.upload.CrawlerDatasetESUploader>
+        }
+        self._entry_points = None
+
+    def register(self, name, cls):
+        self._classes[name] = cls
+
+    def __getitem__(self, name):
+        if name not in self._classes:
+            if name in self.MODULES:
+                importlib.import_module(self.MODULES[name])
+            elif name in self.entry_points:
+                self._classes[name] = self.entry_points[name].load()
+        return self._classes[name]
+
+    def __iter__(self):
+        return iter(dict.fromkeys([*self._classes, *self.MODULES, *self.entry_points]))
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    @property
+    def entry_points(self):
+        if self._entry_points is None:
+            try:
+                found = metadata.entry_points(group=self.ENTRY_POINTS)
+            except TypeError:  # python < 3.10
+                found = metadata.entry_points().get(self.ENTRY_POINTS, [])
+            self._entry_points = {entry_point.name: entry_point for entry_point in found}
+        return self._entry_points
+
+
+uploaders = UploaderRegistry()
 
 
 class CrawlerESUploader:
@@ -51,29 +117,168 @@ class CrawlerESUploader:
     BIOTHING_TYPE = 'biothing'
     BIOTHING_VERSION = 'c1.0'
 
-    def __init__(self, **kwargs):
+    #---------------------------#
+    #          Workers          #
+    #---------------------------#
+
+    # attributes not copied to transform workers, like ES clients
+    WORKER_EXCLUDE = ('metadata', 'indexing', 'hashes', 'checkpoint')
+
+    def __init__(self, transform_workers=1, batch_size=500,
+                 checkpoint=None, resume=False, incremental=False, **kwargs):
+        self.transform_workers = int(transform_workers)  # 0 to transform in-process
+        self.batch_size = int(batch_size)  # documents per transform task and bulk request
         self.metadata = DataMetadata(self)
-        self.indexing = DataReindex(self, **kwargs)
+        self.indexing = DataReindex(self, recreate=not (resume or incremental), **kwargs)
+
+        if incremental and self.INDEX_FIXCONFLICTS:
+            # documents may then be written to other indices
+            raise ValueError('Incremental uploads do not support INDEX_FIXCONFLICTS.')
+
+        # only transform documents changed since the last incremental upload
+        self.hashes = None
+        if incremental:
+            self.hashes = DataHashes(self)
+
+        # local state file to record progress in, required to resume
+        if resume and not checkpoint:
+            checkpoint = f'{self.indexing.dest_index}.checkpoint.json'
+        self.checkpoint = None
+        if checkpoint:
+            self.checkpoint = stages.Checkpoint(
+                checkpoint, self.indexing.src_index, self.indexing.dest_index)
+        self.resume = resume
 
     def __init_subclass__(cls):
         super().__init_subclass__()
-        uploaders[cls.NAME] = cls
+        uploaders.register(cls.NAME, cls)
 
     def upload(self):
         """
         Upload the document and apply transformations.
         This is primarily how to interact with this class.
+
+        Documents stream through three overlapping stages:
+        scanning the source index on a reader thread,
+        transforming batches in a pool of worker processes,
+        and writing to the destination with parallel bulk requests.
+
+        With a checkpoint, progress is saved as documents are written,
+        and a resumed upload continues from there into the existing
+        destination index instead of starting over.
+
+        When incremental, documents whose content is unchanged since
+        the last incremental upload are skipped, and documents gone
+        from the source index are deleted from the destination.
+        A destination built by another BIOTHING_VERSION is recreated.
         """
         # reindex as-is
         if not self.INDEX_MAPPINGS and self.extract_id is CrawlerESUploader.extract_id:
             self.indexing.reindex()
             return
 
-        # apply transformation
-        for doc in self.indexing.scan():
+        scanned = stages.StageMeter('scan')
+        transformed = stages.StageMeter('transform')
+        indexed = stages.StageMeter('index')
+
+        checkpoint = self.checkpoint
+        if checkpoint:
+            # taken before the scan opens its point in time
+            checkpoint.source = self.indexing.src_state()
+            after = checkpoint.load() if self.resume else None
+            docs = self.indexing.scan(ordered=True, after=after)
+        else:
+            docs = self.indexing.scan()
+
+        hashes = self.hashes
+        if hashes:
+            hashes.load()
+
+        docs = stages.threaded(scanned.each(docs), self.batch_size * 4)
+        if hashes:
+            docs = hashes.changed(docs)
+        batches = stages.batched(docs, self.batch_size)
+        if checkpoint:
+            batches = checkpoint.mark(batches, key=self.indexing.position)
+        if hashes:
+            batches = hashes.mark(batches)
+
+        if self.transform_workers > 0:
+            # forking now would copy the locks held by the reader
+            # and client threads, workers fork from a clean server instead.
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            executor = ProcessPoolExecutor(
+                self.transform_workers,
+                mp_context=multiprocessing.get_context(method),
+                initializer=_init_transform_worker,
+                initargs=(type(self), self._worker_state()))
+            results = stages.pooled(
+                executor, _transform_docs, batches,
+                self.transform_workers * 2)
+        else:
+            executor = None
+            results = (list(self.transform_docs(batch)) for batch in batches)
+
+        try:
+            results = transformed.batches(results)
+            if checkpoint:
+                results = checkpoint.track(results)
+            if hashes:
+                results = hashes.track(results)
+            results = chain.from_iterable(results)
+
+            if self.INDEX_FIXCONFLICTS:
+                written = ((True, self.indexing.index(_id, _source)) for _id, _source in results)
+            else:
+                written = self.indexing.bulk(results)
+
+            for ok, result in written:
+                if not ok:
+                    logging.error('Failed to index: %s', result)
+                indexed.add()
+                if checkpoint:
+                    checkpoint.ack()
+                if hashes:
+                    hashes.ack(ok, result)
+                if indexed.count % 10000 == 0:
+                    stages.report(scanned, transformed, indexed)
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
+
+        stages.report(scanned, transformed, indexed)
+        if hashes:
+            # only a complete scan tells which documents are gone
+            hashes.finish(delete_removed=not self.resume)
+        if checkpoint:
+            checkpoint.finish()
+
+    def _worker_state(self):
+        """
+        Instance attributes given to uploaders in transform workers.
+        """
+        return {
+            name: value for name, value in vars(self).items()
+            if name not in self.WORKER_EXCLUDE
+        }
+
+    def transform_docs(self, docs):
+        """
+        Transform a batch of documents read from the source index.
+        Yield one (_id, _source) pair for the destination index
+        per document, in the same order as the input.
+        Override to share work, like remote lookups, across documents.
+
+        With transform_workers, this runs in worker processes on
+        an uploader made without calling __init__, holding a copy
+        of the attributes set on this one except WORKER_EXCLUDE.
+        Those attributes must be picklable, and changes made to
+        them in a worker are not seen by other workers or here.
+        """
+        for doc in docs:
             _id = self.extract_id(doc)
             _source = self.transform_doc(TransformDoc(doc))
-            self.indexing.index(_id, _source)
+            yield _id, dict(_source)
 
     def extract_id(self, doc):
         """
@@ -97,11 +302,16 @@ class CrawlerESUploader:
     def transform_doc(self, doc: TransformDoc) -> dict:
         """
         Modify documents after the quick transform phase.
+        May run in a transform worker, see transform_docs.
         """
         # override here
         return doc
 
 
+# subclasses register themselves, the base class does not
+uploaders.register(CrawlerESUploader.NAME, CrawlerESUploader)
+
+
 class CrawlerDatasetESUploader(CrawlerESUploader):
 
     NAME = 'dataset'
@@ -117,6 +327,21 @@ class CrawlerDatasetESUploader(CrawlerESUploader):
         return base
 
 
+# the uploader used by this transform worker process
+_worker_uploader = None
+
+
+def _init_transform_worker(uploader_class, state):
+    global _worker_uploader
+    # transforms do not use the ES clients made in __init__
+    _worker_uploader = uploader_class.__new__(uploader_class)
+    _worker_uploader.__dict__.update(state)
+
+
+def _transform_docs(docs):
+    return list(_worker_uploader.transform_docs(docs))
+
+
 class DataReindex:
     """
     An Elasticsearch Reindexing Unit.
@@ -130,7 +355,10 @@ class DataReindex:
         self,
         uploader,   # crawler.upload.CrawlerESUploader instance
         src_index, dest_index,  # indices to read from and write to
-        src_host=None, dest_host=None  # default host localhost:9200
+        src_host=None, dest_host=None,  # default host localhost:9200
+        scan_slices=1, scan_size=30,  # parallel sliced scrolls and their page size
+        index_threads=4, index_chunk_size=500,  # parallel bulk requests and their size
+        recreate=True  # drop the destination index before the first write
     ):
         self.src_client = Elasticsearch(src_host)
         self.src_index = src_index
@@ -138,6 +366,11 @@ class DataReindex:
         self.dest_client = Elasticsearch(dest_host)
         self.dest_index = dest_index
 
+        self.scan_slices = max(int(scan_slices), 1)
+        self.scan_size = int(scan_size)
+        self.index_threads = max(int(index_threads), 1)
+        self.index_chunk_size = int(index_chunk_size)
+
         self.uploader = uploader
 
         mappings = dict(self.uploader.INDEX_MAPPINGS)
@@ -146,9 +379,12 @@ class DataReindex:
         self.indexing = CrawlerIndices(
             self.dest_client, 
             mappings, # including _meta field
-            self.uploader.INDEX_SETTINGS)
+            self.uploader.INDEX_SETTINGS,
+            recreate)
 
         self._valid_indices = set()
+        # (_id, position) of hits read by an ordered scan, see position()
+        self._positions = collections.deque()
 
     def reindex(self, query=None):
         """
@@ -160,7 +396,7 @@ class DataReindex:
             self.dest_index, query, target_client=self.dest_client
         )
 
-    def scan(self):
+    def scan(self, ordered=False, after=None):
         """
         An iterator that yields all hits as returned by underlining scroll requests.
         A transformation will be applied, for example, if the original hit is:
@@ -182,12 +418,136 @@ class DataReindex:
             'symbol': 'cdk2',
             'name': 'cyclin dependent kinase 2
         }
+        When scan_slices is more than 1, the index is read with
+        that many sliced scrolls in parallel and the order of hits
+        is not preserved.
+        When ordered, hits are read in a stable order with search_after,
+        optionally starting after a given position, so that the position
+        can be saved and resumed later, see position(). Slices are not
+        used then. On Elasticsearch 7.12 and later the order is that of
+        a point in time, which sorts on _shard_doc and needs no fielddata,
+        and resuming requires that the source index was not written to
+        in between, see src_state(). Older clusters sort on _id.
         """
-        for doc in scan(self.src_client, index=self.src_index, scroll="5m", size=30):
+        if ordered:
+            if self.scan_slices > 1:
+                logging.warning('Reading %s in _id order without slices.', self.src_index)
+            hits = self._ordered_scan(after)
+        elif self.scan_slices > 1:
+            hits = self._sliced_scan()
+        else:
+            hits = self._scan_slice()
+
+        for doc in hits:
             _doc = {'_id': doc['_id']}
             _doc.update(doc['_source'])
             yield _doc
 
+    def position(self, doc):
+        """
+        Return the search_after position of a document read by
+        an ordered scan, to resume reading right after it.
+        Documents must be passed in the order they were read,
+        skipping any of them is allowed.
+        """
+        while True:
+            _id, position = self._positions.popleft()
+            if _id == doc['_id']:
+                return position
+
+    def src_state(self):
+        """
+        Describe the source index as it is now, to tell if it was
+        written to or merged since. Positions of a point in time
+        are shard numbers and Lucene doc ids, which then change.
+        """
+        uuids = self.src_client.indices.get_settings(index=self.src_index, name='index.uuid')
+        stats = self.src_client.indices.stats(index=self.src_index, level='shards')
+        state = {}
+        for name, index in sorted(stats['indices'].items()):
+            shards = {}
+            for num, copies in sorted(index['shards'].items()):
+                for copy in copies:
+                    if copy['routing']['primary']:
+                        shards[num] = [copy['seq_no']['max_seq_no'], copy['segments']['count']]
+            state[name] = {
+                'uuid': uuids[name]['settings']['index']['uuid'],
+                'docs': index['primaries']['docs']['count'],
+                'shards': shards
+            }
+        return state
+
+    def _ordered_scan(self, after=None):
+        # a position saved by an _id sorted scan is an _id
+        if isinstance(after, str) or self._src_version() < (7, 12):
+            hits = self._id_scan(after)
+        else:
+            hits = self._pit_scan(after)
+        for hit in hits:
+            self._positions.append((hit['_id'], hit['sort']))
+            yield hit
+
+    def _src_version(self):
+        number = self.src_client.info()['version']['number']
+        return tuple(int(part) for part in number.split('-')[0].split('.')[:2])
+
+    def _pit_scan(self, after=None):
+        pit = self.src_client.open_point_in_time(index=self.src_index, keep_alive='5m')['id']
+        body = {
+            "query": {"match_all": {}},
+            "pit": {"id": pit, "keep_alive": "5m"},
+            "sort": [{"_shard_doc": "asc"}],
+            "size": self.scan_size
+        }
+        try:
+            while True:
+                if after is not None:
+                    body["search_after"] = after
+                res = self.src_client.search(body=body)
+                body["pit"]["id"] = res.get('pit_id', body["pit"]["id"])
+                hits = res['hits']['hits']
+                if not hits:
+                    return
+                yield from hits
+                after = hits[-1]['sort']
+        finally:
+            self.src_client.close_point_in_time(body={"id": body["pit"]["id"]})
+
+    def _id_scan(self, after=None):
+        # sorting on _id loads it into fielddata on the heap
+        body = {
+            "query": {"match_all": {}},
+            "sort": [{"_id": "asc"}],
+            "size": self.scan_size
+        }
+        while True:
+            if after is not None:
+                body["search_after"] = [after]
+            res = self.src_client.search(index=self.src_index, body=body)
+            hits = res['hits']['hits']
+            if not hits:
+                return
+            for hit in hits:
+                hit['sort'] = hit['sort'][0]
+            yield from hits
+            after = hits[-1]['sort']
+
+    def _scan_slice(self, slice_id=None):
+        query = None
+        if slice_id is not None:
+            query = {"slice": {"id": slice_id, "max": self.scan_slices}}
+        return scan(
+            self.src_client, index=self.src_index, query=query,
+            scroll="5m", size=self.scan_size)
+
+    def _sliced_scan(self):
+        """
+        Read every slice of the source index on its own worker thread.
+        Hits are passed through a bounded queue as they arrive.
+        """
+        slices = [self._scan_slice(slice_id) for slice_id in range(self.scan_slices)]
+        return stages.merged(slices, self.scan_size * self.scan_slices * 2)
+
     def index(self, _id, _source):
         """
         Creates or updates a document in the destination index.
@@ -210,6 +570,166 @@ class DataReindex:
             else:  # success
                 break
 
+    def bulk(self, docs):
+        """
+        Write (_id, _source) pairs to the destination index
+        with parallel bulk requests. Yield (ok, result) per document.
+        """
+        return self.indexing.parallel_bulk(
+            self.dest_index, docs,
+            self.index_threads, self.index_chunk_size)
+
+
+class DataHashes:
+    """
+    Content hashes of source documents from the last incremental
+    upload, kept in a sidecar index next to the destination index.
+    Each entry is keyed by the source _id and holds the hash and
+    the _id of the document it was uploaded as.
+
+    A destination index built by another BIOTHING_VERSION is
+    recreated, with its mappings, and everything is uploaded again.
+    Documents given random ids keep the one of their first upload.
+    """
+
+    MAPPINGS = {
+        "dynamic": False,
+        "properties": {
+            "hash": {"type": "keyword"},
+            "dest_id": {"type": "keyword", "index": False}
+        }
+    }
+
+    def __init__(self, uploader):
+        self.uploader = uploader
+        self.client = uploader.indexing.dest_client
+        self.index = 'upload_hashes_' + uploader.indexing.dest_index
+        self.indexing = CrawlerIndices(self.client, self.MAPPINGS, recreate=False)
+
+        # hashing the uploader version as well means a new
+        # version of the transform code re-uploads everything
+        self._salt = f'{uploader.NAME}:{uploader.BIOTHING_VERSION}:'.encode()
+
+        self.known = {}  # source _id -> (hash, dest_id) from the last upload
+        self.seen = set()  # source _id found in this upload
+        self.unchanged = 0
+
+        self._digests = {}  # source _id -> hash, until batched
+        self._keys = collections.deque()  # [(source _id, hash)] per batch
+        self._pending = collections.deque()  # (source _id, hash, dest_id)
+        self._updates = []
+
+    def digest(self, doc):
+        content = json.dumps(doc, sort_keys=True, default=str).encode()
+        return hashlib.sha1(self._salt + content).hexdigest()
+
+    def load(self):
+        version = self._dest_version()
+        if version is not None and version != self.uploader.BIOTHING_VERSION:
+            logging.info('%s was built by version %s, recreating it.',
+                         self.uploader.indexing.dest_index, version)
+            self.uploader.indexing.indexing.recreate = True
+            self.client.indices.delete(index=self.index, ignore=[404])
+            return
+        if not self.client.indices.exists(index=self.index):
+            logging.info('No content hashes in %s, uploading everything.', self.index)
+            return
+        for hit in scan(self.client, index=self.index, size=1000):
+            self.known[hit['_id']] = (hit['_source']['hash'], hit['_source'].get('dest_id'))
+        logging.info('Loaded %s content hashes from %s.', len(self.known), self.index)
+
+    def _dest_version(self):
+        try:
+            res = self.client.indices.get_mapping(index=self.uploader.indexing.dest_index)
+        except NotFoundError:
+            return None
+        # keyed by the index name, also when dest_index is an alias
+        meta = next(iter(res.values()))['mappings'].get('_meta', {})
+        return meta.get('build_version')
+
+    def changed(self, docs):
+        """
+        Pass through only new documents or those whose content changed.
+        """
+        for doc in docs:
+            digest = self.digest(doc)
+            self.seen.add(doc['_id'])
+            if self.known.get(doc['_id'], (None,))[0] == digest:
+                self.unchanged += 1
+                continue
+            self._digests[doc['_id']] = digest
+            yield doc
+
+    def mark(self, batches):
+        """
+        Remember the source _id and hash of each document, before transforming.
+        """
+        for batch in batches:
+            self._keys.append([(doc['_id'], self._digests.pop(doc['_id'])) for doc in batch])
+            yield batch
+
+    def track(self, results):
+        """
+        Pair each transformed document with the source it came from.
+        """
+        for result in results:
+            tracked = []
+            for (src_id, digest), (dest_id, _source) in zip(self._keys.popleft(), result):
+                if dest_id is None:  # replace the document of the last upload
+                    dest_id = self.known.get(src_id, (None, None))[1]
+                self._pending.append((src_id, digest, dest_id))
+                tracked.append((dest_id, _source))
+            yield tracked
+
+    def ack(self, ok, result):
+        """
+        Record the hash of the next document once it has been written,
+        with the _id given by Elasticsearch if it had none.
+        """
+        src_id, digest, dest_id = self._pending.popleft()
+        if ok:
+            if dest_id is None:
+                dest_id = next(iter(result.values())).get('_id')
+            self._updates.append((src_id, {"hash": digest, "dest_id": dest_id}))
+        if len(self._updates) >= 1000:
+            self._save()
+
+    def _save(self):
+        results = self.indexing.bulk(self.index, self._updates)
+        for ok, result in results:
+            if not ok:
+                logging.error('Failed to save content hash: %s', result)
+        self._updates = []
+
+    def finish(self, delete_removed=True):
+        """
+        Save the remaining hashes and delete documents
+        no longer in the source index from the destination.
+        """
+        self._save()
+        removed = [src_id for src_id in self.known if src_id not in self.seen]
+        if not delete_removed:
+            logging.info('Not deleting %s documents after a partial scan.', len(removed))
+            removed = []
+
+        actions = []
+        for src_id in removed:
+            dest_id = self.known[src_id][1]
+            if dest_id is not None:
+                actions.append({
+                    "_op_type": "delete",
+                    "_index": self.uploader.indexing.dest_index,
+                    "_id": dest_id
+                })
+            actions.append({"_op_type": "delete", "_index": self.index, "_id": src_id})
+        for ok, result in streaming_bulk(
+                self.client, actions,
+                raise_on_error=False, raise_on_exception=False):
+            if not ok and result.get('delete', {}).get('status') != 404:
+                logging.error('Failed to delete: %s', result)
+
+        logging.info('%s unchanged, %s removed.', self.unchanged, len(removed))
+
 
 class DataMetadata:
 
@@ -234,18 +754,38 @@ class DataMetadata:
 
 class CrawlerIndices:
 
-    def __init__(self, client, mappings=None, settings=None):
+    def __init__(self, client, mappings=None, settings=None, recreate=True):
 
         self.client = client
+        self.recreate = recreate  # otherwise keep writing into existing indices
         self.settings = settings or {}
         self.mappings = mappings if mappings is not None else dict(enabled="false")
-        self._es_version = int(self.client.info()['version']['number'].split('.')[0])
         self._valid_indices = set()
+        self._lock = threading.Lock()  # writes may come from worker threads
+        self._version = None
 
-    def index(self, _index, _id, _source, alias=None):
+    @property
+    def _es_version(self):
+        # asked on first write, so that creating this object needs no connection
+        if self._version is None:
+            self._version = int(self.client.info()['version']['number'].split('.')[0])
+        return self._version
+
+    def prepare(self, _index, alias=None):
+        """
+        Create the index with the configured settings and mappings
+        the first time it is written to in this session.
+        """
+        with self._lock:
+            self._prepare(_index, alias)
+
+    def _prepare(self, _index, alias):
 
         if _index not in self._valid_indices:
             if self.client.indices.exists(index=_index):
+                if not self.recreate:
+                    self._valid_indices.add(_index)
+                    return
                 self.client.indices.delete(index=_index)
             settings = {
                 "number_of_shards": 1,
@@ -266,10 +806,52 @@ class CrawlerIndices:
                 body=request_body)
             self._valid_indices.add(_index)
 
+    def index(self, _index, _id, _source, alias=None):
+
+        self.prepare(_index, alias)
         return self.client.index(index=_index, id=_id, body=_source)
 
+    def bulk(self, _index, docs, alias=None):
+        """
+        Index a batch of (_id, _source) pairs with one bulk request.
+        Return a list of (ok, result) tuples in the order of the input,
+        so that callers can report failures document by document.
+        """
+        self.prepare(_index, alias)
+
+        actions = [self._action(_index, _id, _source) for _id, _source in docs]
+        if not actions:
+            return []
+
+        return list(streaming_bulk(
+            self.client, actions,
+            chunk_size=len(actions),
+            max_chunk_bytes=2 ** 31 - 1,
+            raise_on_error=False,
+            raise_on_exception=False))
 
-from .zenodo_covid import ZenodoCovidUploader
-from .immport import ImmPortUploader
-from .immport_covid import ImmPortCovidUploader
-from .ncbi_geo import NCBIGeoUploader
+    def parallel_bulk(self, _index, docs, thread_count=4, chunk_size=500, alias=None):
+        """
+        Stream (_id, _source) pairs into the index using several
+        bulk requests at a time. Only a few chunks are read ahead.
+        Yield (ok, result) tuples in the order of the input.
+        """
+        self.prepare(_index, alias)
+
+        actions = (self._action(_index, _id, _source) for _id, _source in docs)
+        return parallel_bulk(
+            self.client, actions,
+            thread_count=thread_count,
+            chunk_size=chunk_size,
+            queue_size=thread_count,
+            raise_on_error=False,
+            raise_on_exception=False)
+
+    def _action(self, _index, _id, _source):
+
+        action = {"_index": _index, "_source": _source}
+        if _id is not None:
+            action["_id"] = _id
+        if self._es_version < 7:
+            action["_type"] = "_doc"
+        return action
@@ -7,13 +7,34 @@ define("src-index", help="The index that the crawler writes to, typically the sp
 define("src-host", default="localhost:9200", help="Source index's ES addresss.")
 define("dest-index", help="The index that will eventually be used for searching.")
 define("dest-host", default="localhost:9200", help="Destination index's ES address.")
+define("scan-slices", default=1, type=int, help="Number of sliced scrolls to read the source index with in parallel.")
+define("scan-size", default=30, type=int, help="Number of documents per scroll page.")
+define("transform-workers", default=1, type=int, help="Number of processes transforming documents, 0 to transform in-process.")
+define("batch-size", default=500, type=int, help="Number of documents sent to a transform worker at a time.")
+define("index-threads", default=4, type=int, help="Number of bulk requests to the destination in parallel.")
+define("index-chunk-size", default=500, type=int, help="Number of documents per bulk request.")
+define("checkpoint", default="", help="Local file to save upload progress to, read in a stable order.")
+define("resume", default=False, type=bool, help="Continue from the checkpoint into the existing destination index.")
+define("incremental", default=False, type=bool, help="Only upload documents changed since the last incremental upload, delete removed ones.")
 
-parse_command_line()
+# transform workers start from a fresh interpreter that imports this module again
+if __name__ == '__main__':
 
-uploader = uploaders[options.uploader](
-    src_index=options.src_index,
-    src_host=options.src_host,
-    dest_index=options.dest_index,
-    dest_host=options.dest_host
-)
-uploader.upload()
+    parse_command_line()
+
+    uploader = uploaders[options.uploader](
+        src_index=options.src_index,
+        src_host=options.src_host,
+        dest_index=options.dest_index,
+        dest_host=options.dest_host,
+        scan_slices=options.scan_slices,
+        scan_size=options.scan_size,
+        transform_workers=options.transform_workers,
+        batch_size=options.batch_size,
+        index_threads=options.index_threads,
+        index_chunk_size=options.index_chunk_size,
+        checkpoint=options.checkpoint,
+        resume=options.resume,
+        incremental=options.incremental
+    )
+    uploader.upload()
@@ -1,10 +1,21 @@
+import io
+import json
+import logging
+import os
+import sqlite3
+import time
 import warnings
-from typing import Optional, Tuple, List, Iterable, Dict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Optional, Tuple, List, Iterable, Dict, Union
 import xml.etree.ElementTree as ElementTree
 
 import requests
+import requests.adapters
 from scrapy.selector import Selector
 
+from crawler.ratelimit import rate_limiter
+
 
 def transform(doc, mappings):
 
@@ -30,145 +41,418 @@ def pmid_to_citation(pmid):
     Use pmid to find citation string
     '''
     url = 'https://www.ncbi.nlm.nih.gov/sites/PubmedCitation?id=' + pmid
+    rate_limiter.wait(url)
     body = requests.get(url, timeout=5).text
     citation = Selector(text=body).xpath('string(/)').get()
     return citation.replace(u'\xa0', u' ')
 
 
-def batch_get_pmid_eutils(pmids: Iterable[str], timeout: float, api_key: Optional[str] = None) -> Dict[str, Dict]:
+class PubMedCache:
+    """Persistent cache of parsed E-utilities results keyed by PMID
+
+    Stored in SQLite so that it survives between uploads and can be
+    shared by transform worker processes. PMIDs that E-utilities does
+    not return, typically malformed IDs, are cached as missing for a
+    shorter time. Hit and miss counts are kept in the same database.
+    """
+
+    def __init__(self, path: str, ttl: float = 30 * 24 * 3600, negative_ttl: float = 24 * 3600):
+        """
+        :param path: SQLite database file, created if it does not exist
+        :param ttl: Seconds before a cached article is fetched again
+        :param negative_ttl: Seconds before a missing PMID is tried again
+        """
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._conn = None
+        self._pid = None
+
+    def _connect(self) -> sqlite3.Connection:
+        # connections must not be shared with forked processes
+        if self._conn is None or self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS pubmed (pmid TEXT PRIMARY KEY, doc TEXT, fetched REAL)')
+            conn.execute('CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, count INTEGER)')
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def get(self, pmids: Iterable[str]) -> Tuple[Dict[str, Optional[Dict]], List[str]]:
+        """Look up PMIDs in the cache
+
+        :param pmids: A list of PubMed PMIDs
+        :return: Cached results, with None for PMIDs known to be missing,
+            and the PMIDs that need to be fetched.
+        """
+        pmids = list(dict.fromkeys(pmids))
+        conn = self._connect()
+        now = time.time()
+        rows = []
+        for start in range(0, len(pmids), 500):  # SQLite limits query variables
+            chunk = pmids[start:start + 500]
+            rows += conn.execute(
+                f"SELECT pmid, doc, fetched FROM pubmed WHERE pmid IN ({','.join('?' * len(chunk))})",
+                chunk).fetchall()
+
+        found = {}
+        for pmid, doc, fetched in rows:
+            if doc is None:
+                if now - fetched < self.negative_ttl:
+                    found[pmid] = None
+            elif now - fetched < self.ttl:
+                found[pmid] = json.loads(doc)
+        missing = [pmid for pmid in pmids if pmid not in found]
+
+        negative = sum(doc is None for doc in found.values())
+        self._count(hits=len(found) - negative, negative_hits=negative, misses=len(missing))
+        return found, missing
+
+    def put(self, docs: Dict[str, Dict], missing: Iterable[str] = ()):
+        """Store fetched results, and PMIDs that were requested but not returned
+
+        :param docs: PMIDs and the corresponding dictionary with citation and grant info.
+        :param missing: PMIDs to remember as missing
+        """
+        now = time.time()
+        rows = [(pmid, json.dumps(doc), now) for pmid, doc in docs.items()]
+        rows += [(pmid, None, now) for pmid in missing]
+        with self._connect() as conn:
+            conn.executemany('INSERT OR REPLACE INTO pubmed VALUES (?, ?, ?)', rows)
+
+    def _count(self, **counts):
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT INTO stats VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET count = count + excluded.count',
+                [(name, count) for name, count in counts.items() if count])
+
+    def stats(self) -> Dict[str, int]:
+        """Lookup counts since the cache was created
+
+        :return: Numbers of hits, negative_hits and misses
+        """
+        counts = {'hits': 0, 'negative_hits': 0, 'misses': 0}
+        counts.update(self._connect().execute('SELECT name, count FROM stats').fetchall())
+        return counts
+
+    @contextmanager
+    def reporting(self):
+        """Log the lookups made by all processes while in this context"""
+        before = self.stats()
+        yield self
+        after = self.stats()
+        logging.info('PubMed cache: %s', ', '.join(
+            f'{after[name] - before[name]} {name}' for name in after))
+
+
+# set EUTILS_CACHE to an empty string to disable caching
+_cache_path = os.getenv('EUTILS_CACHE', os.path.expanduser('~/.cache/biothings.crawler/eutils.sqlite'))
+pubmed_cache = PubMedCache(_cache_path) if _cache_path else None
+
+
+class EutilsClient:
+    """E-utilities client for many concurrent requests
+
+    * Reuse connections from a persistent pool
+    * Run up to `max_workers` requests at once, spaced by the shared rate limiter
+    * Retry with exponential backoff on 429, 5xx and connection errors
+    * POST long ID lists instead of putting them in the URL
+    """
+
+    BASE_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/'
+    RETRY_STATUS = (429, 500, 502, 503, 504)
+    POST_MIN_IDS = 200  # NCBI recommends POST for more than 200 UIDs
+
+    def __init__(self, max_workers: int = 4, retries: int = 5, backoff: float = 0.5):
+        """
+        :param max_workers: Maximum number of requests in flight
+        :param retries: Times to retry a failed request
+        :param backoff: Seconds to wait before the first retry, doubled each time
+        """
+        self.max_workers = max_workers
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+        self._pid = None
+
+    @property
+    def session(self) -> requests.Session:
+        # connections must not be shared with forked processes
+        if self._session is None or self._pid != os.getpid():
+            session = requests.Session()
+            session.mount('https://', requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers))
+            self._session, self._pid = session, os.getpid()
+        return self._session
+
+    def request(self, endpoint: str, params: Dict[str, str], timeout: float,
+                api_key: Optional[str] = None) -> str:
+        """Make an E-utilities request and return the response body
+
+        :param endpoint: Utility name, like efetch.fcgi
+        :param params: Query parameters, an 'id' list is comma separated
+        :param timeout: Time before the connection times out
+        :param api_key: API Key from NCBI to access E-utilities
+        :return: The response body
+        """
+        url = self.BASE_URL + endpoint
+        params = dict(params)
+        if api_key is not None:
+            params['api_key'] = api_key
+        ids = params.get('id', '')
+        post = ids.count(',') + 1 >= self.POST_MIN_IDS
+
+        for attempt in range(self.retries + 1):
+            # throttle request rates, NCBI says up to 10 requests per second with API Key, 3/s without.
+            rate_limiter.wait(url, rate=10 if api_key is not None else 3)
+            try:
+                if post:
+                    res = self.session.post(url, data=params, timeout=timeout)
+                else:
+                    res = self.session.get(url, params=params, timeout=timeout)
+            except (requests.ConnectionError, requests.Timeout) as exc:
+                if attempt == self.retries:
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logging.warning('%s failed: %s, retrying in %ss.', endpoint, exc, delay)
+            else:
+                if res.status_code not in self.RETRY_STATUS or attempt == self.retries:
+                    res.raise_for_status()
+                    return res.text
+                delay = self.backoff * 2 ** attempt
+                retry_after = res.headers.get('Retry-After', '')
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+                logging.warning('%s returned %s, retrying in %ss.', endpoint, res.status_code, delay)
+            time.sleep(delay)
+
+    def efetch_pubmed(self, pmids: List[str], timeout: float, api_key: Optional[str] = None,
+                      batch_size: int = 200) -> Dict[str, Dict]:
+        """Fetch citation and funding info in batches, several at a time
+
+        :param pmids: A list of PubMed PMIDs
+        :param timeout: Time before the connection times out
+        :param api_key: API Key from NCBI to access E-utilities
+        :param batch_size: PMIDs per request
+        :return: A dictionary containing pmids and the corresponding dictionary with citation and grant info.
+        """
+        batches = [pmids[start:start + batch_size] for start in range(0, len(pmids), batch_size)]
+
+        def fetch(batch):
+            body = self.request('efetch.fcgi', {
+                'db': 'pubmed',
+                'id': ','.join(batch),
+                'retmode': 'xml'
+            }, timeout, api_key)
+            return parse_pmid_eutils(body)
+
+        ret = {}
+        if len(batches) == 1:
+            ret.update(fetch(batches[0]))
+        elif batches:
+            with ThreadPoolExecutor(min(self.max_workers, len(batches))) as executor:
+                for result in executor.map(fetch, batches):
+                    ret.update(result)
+        return ret
+
+
+eutils_client = EutilsClient()
+
+
+def batch_get_pmid_eutils(pmids: Iterable[str], timeout: float, api_key: Optional[str] = None,
+                          cache: Optional[PubMedCache] = None, batch_size: int = 200) -> Dict[str, Dict]:
     """Use pmid to retrieve both citation and funding info in batch
 
     :param pmids: A list of PubMed PMIDs
     :param timeout: Time before the connection times out
     :param api_key: API Key from NCBI to access E-utilities
+    :param cache: Only fetch PMIDs not found in this cache, and store the results
+    :param batch_size: PMIDs per efetch request, requests are made concurrently
     :return: A dictionary containing pmids and the corresponding dictionary with citation and grant info.
     """
     # warn if got a single str
     if pmids is str:
         warnings.warn(f"Got str:{pmids} as parameter, expecting an Iterable of str", RuntimeWarning)
-    base_api_url = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi'
-    parameters = {
-        'db': 'pubmed',
-        'id': ','.join(pmids),
-        'retmode': 'xml'
-    }
-    if api_key is not None:
-        parameters.update({'api_key': api_key})
-    body = requests.get(base_api_url, params=parameters, timeout=timeout).text
-    root = ElementTree.fromstring(body)
+    if cache is None:
+        return fetch_pmid_eutils(pmids, timeout, api_key, batch_size)
+
+    ret, missing = cache.get(pmids)
+    # malformed IDs are never sent, see SDY1655
+    malformed = [pmid for pmid in missing if not pmid.isdigit()]
+    missing = [pmid for pmid in missing if pmid.isdigit()]
+    if missing:
+        fetched = fetch_pmid_eutils(missing, timeout, api_key, batch_size)
+        malformed += [pmid for pmid in missing if pmid not in fetched]
+        ret.update(fetched)
+    else:
+        fetched = {}
+    cache.put(fetched, malformed)
+    return {pmid: doc for pmid, doc in ret.items() if doc is not None}
+
+
+def fetch_pmid_eutils(pmids: Iterable[str], timeout: float, api_key: Optional[str] = None,
+                      batch_size: int = 200) -> Dict[str, Dict]:
+    """Request citation and funding info for PMIDs from E-utilities efetch
+
+    :param pmids: A list of PubMed PMIDs
+    :param timeout: Time before the connection times out
+    :param api_key: API Key from NCBI to access E-utilities
+    :param batch_size: PMIDs per efetch request, requests are made concurrently
+    :return: A dictionary containing pmids and the corresponding dictionary with citation and grant info.
+    """
+    return eutils_client.efetch_pubmed(list(pmids), timeout, api_key, batch_size)
+
+
+# paths relative to a PubmedArticle element
+_PMID = 'MedlineCitation/PMID'
+_PUBDATE = 'MedlineCitation/Article/Journal/JournalIssue/PubDate'
+_CITE_TITLE = (
+    ('MedlineCitation/Article/ArticleTitle', '{} '),
+    ('MedlineCitation/MedlineJournalInfo/MedlineTA', '{}'),
+)
+_CITE_LOCATION = (
+    ('MedlineCitation/Article/Journal/JournalIssue/Volume', '{}'),
+    ('MedlineCitation/Article/Journal/JournalIssue/Issue', '({})'),
+    ('MedlineCitation/Article/Pagination/MedlinePgn', ':{}'),
+)
+_CITE_PMID = (
+    (_PMID, ' PMID: {}'),
+)
+_MONTH_ABBR = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+
+def parse_pmid_eutils(body: Union[str, bytes]) -> Dict[str, Dict]:
+    """Parse citation and funding info from an efetch PubmedArticleSet
+
+    Articles are parsed one at a time and discarded once processed,
+    so memory use does not grow with the number of articles.
+
+    :param body: XML response body from efetch
+    :return: A dictionary containing pmids and the corresponding dictionary with citation and grant info.
+    """
+    if isinstance(body, str):
+        body = body.encode('utf-8')
     ret = {}
+    root = None
+    for event, elem in ElementTree.iterparse(io.BytesIO(body), events=('start', 'end')):
+        if root is None:
+            root = elem
+        elif event == 'end' and elem.tag == 'PubmedArticle':
+            pmid, info = _parse_pubmed_article(elem)
+            ret[pmid] = info
+            elem.clear()
+            root.clear()  # drop the processed articles
+    return ret
 
+
+def _construct_cite_partial(xml, features):
     # func. to build partial string
-    def construct_cite_partial(xml, features):
-        partial_cite = ''
-        for feature, template in features:
-            if xml.find(feature) is not None:
-                text = xml.find(feature).text
-                partial_cite += template.format(text)
-        return partial_cite
-
-    for pubmed_article in root.findall('.//PubmedArticle'):
-        pmid = pubmed_article.find('.//MedlineCitation/PMID').text
-        grants = []
-        for grant_element in pubmed_article.findall('.//Grant'):
-            grant = {}
-            if grant_element.find('Agency') is not None:
-                grant['funder'] = {
-                    '@type': 'Organization',
-                    'name': grant_element.find('Agency').text
-                }
-            if grant_element.find('GrantID') is not None:
-                grant['identifier'] = grant_element.find('GrantID').text
-            if grant:
-                grants.append(grant)
-        # citation field
-        # ANSI/NISO Z39.29-2005 (R2010), I don't have time to implement the full specs, and I cannot find any library
-        citation = ''
-
-        # author string
-        authors = []
-        for author in pubmed_article.findall('.//Author'):
-            # Check for ValidYN==Y attribute
-            # Mostly articles with errata in Authors field
-            # see PMID: 16155929, 16202713, 17371979, 18047569, etc.
-            valid = author.attrib.get('ValidYN', 'Y')
-            if valid == 'N':
-                continue
-            if author.find('LastName') is not None:
-                names = [author.find('LastName').text, author.find('Initials').text]
-                if author.find('Suffix') is not None:
-                    names.append(author.find('Suffix').text)
-                authors.append(" ".join(names))
-            elif author.find('CollectiveName') is not None:
-                # Has a dot at the end, see PMID:17571346
-                authors.append(author.find('CollectiveName').text + '.')
-            else:
-                warnings.warn(f"Unable to process an author in when handling PMID:{pmid}", RuntimeWarning)
-
-        if len(authors) > 4:
-            string = ', '.join(authors[:4])
-            string += ' et al. '
-            citation += string
-
-        elif len(authors) > 1:
-            string = ', '.join(authors)
-            string += '. '
-            citation += string
-
-        elif len(authors) == 1:
-            citation += authors[0]
-            citation += '. '
-        # See PMID:20703210
-        elif len(authors) == 0:
-            citation += "[No authors listed] "
+    partial_cite = ''
+    for feature, template in features:
+        elem = xml.find(feature)
+        if elem is not None:
+            partial_cite += template.format(elem.text)
+    return partial_cite
+
+
+def _parse_pubmed_article(pubmed_article) -> Tuple[str, Dict]:
+    pmid = pubmed_article.find(_PMID).text
+    grants = []
+    for grant_element in pubmed_article.iter('Grant'):
+        grant = {}
+        agency = grant_element.find('Agency')
+        if agency is not None:
+            grant['funder'] = {
+                '@type': 'Organization',
+                'name': agency.text
+            }
+        grant_id = grant_element.find('GrantID')
+        if grant_id is not None:
+            grant['identifier'] = grant_id.text
+        if grant:
+            grants.append(grant)
+    # citation field
+    # ANSI/NISO Z39.29-2005 (R2010), I don't have time to implement the full specs, and I cannot find any library
+    citation = ''
+
+    # author string
+    authors = []
+    for author in pubmed_article.iter('Author'):
+        # Check for ValidYN==Y attribute
+        # Mostly articles with errata in Authors field
+        # see PMID: 16155929, 16202713, 17371979, 18047569, etc.
+        valid = author.attrib.get('ValidYN', 'Y')
+        if valid == 'N':
+            continue
+        # first text of each child tag, in one pass
+        parts = {}
+        for child in author:
+            parts.setdefault(child.tag, child.text)
+        if 'LastName' in parts:
+            names = [parts['LastName'], parts['Initials']]
+            if 'Suffix' in parts:
+                names.append(parts['Suffix'])
+            authors.append(" ".join(names))
+        elif 'CollectiveName' in parts:
+            # Has a dot at the end, see PMID:17571346
+            authors.append(parts['CollectiveName'] + '.')
         else:
-            pass  # unreachable
-        # FIXME: Does not handle elements with tags inside
-        #  Like having <i>more text</i>, see PMID:28289389 for example.
-        citation += construct_cite_partial(pubmed_article, (
-            ('.//MedlineCitation/Article/ArticleTitle', '{} '),
-            ('.//MedlineCitation/MedlineJournalInfo/MedlineTA', '{}'),
-        ))
-        pubdate = pubmed_article.find('.//MedlineCitation/Article/Journal/JournalIssue/PubDate')
-        # There are lots of ways to express the date, so far I have seen:
-        #   - Year, Month, Day
-        #   - Year, Month
-        #   - Year, Season
-        #   - MedlineDate
-        # So far concatenating everything seems to produce desirable results
-        month_abbr = ["", "Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
-        if pubdate is not None:
-            date_texts = []
-            for elem in pubdate:
-                if elem.tag == 'Day':
-                    # deal with days that begin with 0
-                    date_texts.append(str(int(elem.text)))
-                elif elem.tag == 'Month':
-                    # deal with months that are numbers
-                    if elem.text.isdigit():
-                        date_texts.append(month_abbr[int(elem.text)])
-                    else:
-                        date_texts.append(elem.text)
+            warnings.warn(f"Unable to process an author in when handling PMID:{pmid}", RuntimeWarning)
+
+    if len(authors) > 4:
+        string = ', '.join(authors[:4])
+        string += ' et al. '
+        citation += string
+
+    elif len(authors) > 1:
+        string = ', '.join(authors)
+        string += '. '
+        citation += string
+
+    elif len(authors) == 1:
+        citation += authors[0]
+        citation += '. '
+    # See PMID:20703210
+    elif len(authors) == 0:
+        citation += "[No authors listed] "
+    else:
+        pass  # unreachable
+    # FIXME: Does not handle elements with tags inside
+    #  Like having <i>more text</i>, see PMID:28289389 for example.
+    citation += _construct_cite_partial(pubmed_article, _CITE_TITLE)
+    pubdate = pubmed_article.find(_PUBDATE)
+    # There are lots of ways to express the date, so far I have seen:
+    #   - Year, Month, Day
+    #   - Year, Month
+    #   - Year, Season
+    #   - MedlineDate
+    # So far concatenating everything seems to produce desirable results
+    if pubdate is not None:
+        date_texts = []
+        for elem in pubdate:
+            if elem.tag == 'Day':
+                # deal with days that begin with 0
+                date_texts.append(str(int(elem.text)))
+            elif elem.tag == 'Month':
+                # deal with months that are numbers
+                if elem.text.isdigit():
+                    date_texts.append(_MONTH_ABBR[int(elem.text)])
                 else:
                     date_texts.append(elem.text)
-            if len(date_texts) > 0:
-                citation += " " + " ".join(date_texts)
-        citation += ';'  # add the semicolon
-
-        citation += construct_cite_partial(pubmed_article, (
-            ('.//MedlineCitation/Article/Journal/JournalIssue/Volume', '{}'),
-            ('.//MedlineCitation/Article/Journal/JournalIssue/Issue', '({})'),
-            ('.//MedlineCitation/Article/Pagination/MedlinePgn', ':{}'),
-        ))
-        citation += '.'
-        citation += construct_cite_partial(pubmed_article, (
-            ('.//MedlineCitation/PMID', ' PMID: {}'),
-        ))
-        ret[pmid] = {
-            'grants': grants,
-            'citation': citation
-        }
-    return ret
+            else:
+                date_texts.append(elem.text)
+        if len(date_texts) > 0:
+            citation += " " + " ".join(date_texts)
+    citation += ';'  # add the semicolon
+
+    citation += _construct_cite_partial(pubmed_article, _CITE_LOCATION)
+    citation += '.'
+    citation += _construct_cite_partial(pubmed_article, _CITE_PMID)
+    return pmid, {
+        'grants': grants,
+        'citation': citation
+    }
 
 
 def get_funding_cite_from_eutils(pmid: str, api_key: Optional[str] = None) -> Tuple[List[str], str]:
@@ -183,3 +467,58 @@ def get_funding_cite_from_eutils(pmid: str, api_key: Optional[str] = None) -> Tu
     citation = doc[pmid]['citation']
 
     return grants, citation
+
+
+class PubMedMixin:
+    """Uploader mixin to enrich a whole batch of documents with PubMed info
+
+    PMIDs are collected from every document in a batch and fetched
+    with a few large efetch requests before any document is transformed.
+    Implement `get_pmids` and use `get_eutils_info` in `transform_doc`.
+    """
+
+    EUTILS_BATCH_SIZE = 200  # PMIDs per efetch request
+    EUTILS_TIMEOUT = 30.0
+
+    _eutils_info = None  # prefetched for the batch being transformed
+
+    def get_pmids(self, doc: Dict) -> List[str]:
+        """Find the PMIDs cited in a source document, before it is transformed
+
+        :param doc: Document from the source index
+        :return: A list of PubMed PMIDs
+        """
+        return []
+
+    def get_eutils_info(self, pmids: Iterable[str]) -> Dict[str, Dict]:
+        """Look up citation and funding info, prefetched for the current batch when possible
+
+        :param pmids: A list of PubMed PMIDs
+        :return: A dictionary containing the pmids found and their citation and grant info.
+        """
+        pmids = list(pmids)
+        if self._eutils_info is None:
+            return self._fetch_eutils_info(pmids)
+        return {pmid: self._eutils_info[pmid] for pmid in pmids if pmid in self._eutils_info}
+
+    def _fetch_eutils_info(self, pmids: List[str]) -> Dict[str, Dict]:
+        if not pmids:
+            return {}
+        return batch_get_pmid_eutils(
+            pmids, timeout=self.EUTILS_TIMEOUT, api_key=os.environ.get('API_KEY'),
+            cache=pubmed_cache, batch_size=self.EUTILS_BATCH_SIZE)
+
+    def transform_docs(self, docs):
+        docs = list(docs)
+        pmids = sorted({pmid for doc in docs for pmid in self.get_pmids(doc)})
+        self._eutils_info = self._fetch_eutils_info(pmids)
+        try:
+            yield from super().transform_docs(docs)
+        finally:
+            self._eutils_info = None
+
+    def upload(self):
+        if pubmed_cache is None:
+            return super().upload()
+        with pubmed_cache.reporting():
+            return super().upload()
@@ -11,19 +11,17 @@
         "Endpoints"
 """
 
-import os
-import time
 import logging
 from datetime import datetime
 
 from . import CrawlerESUploader
-from .helper import batch_get_pmid_eutils
+from .helper import PubMedMixin
 
 
 # TODO: properly setup logger
 
 
-class ImmPortUploader(CrawlerESUploader):
+class ImmPortUploader(PubMedMixin, CrawlerESUploader):
     NAME = 'immport'
     BIOTHING_TYPE = 'dataset'
     BIOTHING_VERSION = 'c1.0'
@@ -34,6 +32,9 @@ class ImmPortUploader(CrawlerESUploader):
 
     # _id is not transformed
 
+    def get_pmids(self, doc):
+        return [pmid.strip() for pmid in doc.get('Pubmed Id', [])]
+
     @staticmethod
     def pi_translation(value):
 
@@ -104,17 +105,8 @@ class ImmPortUploader(CrawlerESUploader):
 
         funding = []
         citations = []
-        if 'API_KEY' in os.environ:
-            api_key = os.environ['API_KEY']
-        else:
-            api_key = None
-        pmids = [pmid.strip() for pmid in doc.get('Pubmed Id', [])]
-        eutils_info = batch_get_pmid_eutils(pmids, timeout=15.0, api_key=api_key)
-        # throttle request rates, NCBI says up to 10 requests per second with API Key, 3/s without.
-        if api_key is not None:
-            time.sleep(0.1)
-        else:
-            time.sleep(0.35)
+        pmids = self.get_pmids(doc)
+        eutils_info = self.get_eutils_info(pmids)
         for pmid in pmids:
             if pmid not in eutils_info:
                 continue  # somehow there could be malformed IDs
@@ -1,22 +1,22 @@
 import copy
-import requests
 
 from .immport import ImmPortUploader
-from .zenodo_covid import ZenodoCovidUploader, MAPPING_URL
+from .zenodo_covid import ZenodoCovidUploader, MAPPING
 from .tdoc import TransformDoc
 
-_mapping = {
-            "properties": requests.get(MAPPING_URL).json(),
-            "dynamic": False
-        }
-
 
 class ImmPortCovidUploader(ImmPortUploader):
     NAME = 'immport_covid'
     # override default settings
     # duplicate the Zenodo ones, as they are the same
     INDEX_SETTINGS = copy.deepcopy(ZenodoCovidUploader.INDEX_SETTINGS)
-    INDEX_MAPPINGS = copy.deepcopy(_mapping)
+
+    @property
+    def INDEX_MAPPINGS(self):
+        return {
+            "properties": MAPPING.get(),
+            "dynamic": False
+        }
 
     def transform_doc(self, doc):
         doc = super(ImmPortCovidUploader, self).transform_doc(doc)
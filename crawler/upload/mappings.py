@@ -0,0 +1,104 @@
+"""
+Remote Elasticsearch Mappings
+
+* Downloaded at first use, not when uploaders are imported.
+* Kept in a local cache file, refreshed after MAX_AGE seconds
+  with a conditional request on the ETag of the cached copy.
+* The cached copy is used when the download fails,
+  and without trying when Env MAPPING_OFFLINE is set.
+* Use Env MAPPING_CACHE to override the cache directory.
+
+Example:
+
+    MAPPING = RemoteMapping(MAPPING_URL)
+    MAPPING.get()  # {"<field_name>": "<elasticsearch_definition>"}
+
+"""
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import requests
+
+CACHE_DIR = os.getenv('MAPPING_CACHE', os.path.expanduser('~/.cache/biothings.crawler/mappings'))
+
+
+class RemoteMapping:
+    """
+    A JSON mapping published at a URL, loaded lazily and cached on disk.
+    """
+
+    MAX_AGE = 24 * 3600  # seconds before checking for a newer version
+    TIMEOUT = 10.0
+
+    def __init__(self, url, cache_dir=CACHE_DIR):
+        self.url = url
+        self.path = os.path.join(cache_dir, hashlib.sha1(url.encode()).hexdigest()[:16] + '.json')
+        self._mapping = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return a copy of the mapping, safe to modify.
+        """
+        with self._lock:
+            if self._mapping is None:
+                self._mapping = self._load()
+        return copy.deepcopy(self._mapping)
+
+    def _load(self):
+
+        cached = self._read()
+        if cached and (os.getenv('MAPPING_OFFLINE') or
+                       time.time() - cached['fetched'] < self.MAX_AGE):
+            return cached['mapping']
+
+        headers = {}
+        if cached and cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        try:
+            response = requests.get(self.url, headers=headers, timeout=self.TIMEOUT)
+            if response.status_code == 304 and cached:
+                logging.debug('Mapping at %s not modified.', self.url)
+                cached['fetched'] = time.time()
+                self._write(cached)
+                return cached['mapping']
+            response.raise_for_status()
+            mapping = response.json()
+        except (requests.RequestException, ValueError) as exc:
+            if not cached:
+                raise RuntimeError(f'Cannot download mapping from {self.url}: {exc}') from exc
+            logging.warning('Cannot download mapping from %s, using the copy cached %s: %s',
+                            self.url, time.ctime(cached['fetched']), exc)
+            return cached['mapping']
+
+        self._write({
+            'url': self.url,
+            'etag': response.headers.get('ETag'),
+            'fetched': time.time(),
+            'mapping': mapping
+        })
+        return mapping
+
+    def _read(self):
+        try:
+            with open(self.path) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            logging.warning('Ignoring corrupt mapping cache %s.', self.path)
+            return None
+
+    def _write(self, cached):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + '.tmp', 'w') as file:
+                json.dump(cached, file)
+            os.replace(self.path + '.tmp', self.path)
+        except OSError as exc:  # still usable for this session
+            logging.warning('Cannot cache mapping in %s: %s', self.path, exc)
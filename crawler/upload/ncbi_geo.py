@@ -8,14 +8,11 @@
     May include a number, or numbers separated by ', '.
 """
 
-import os
-import time
-
 from . import CrawlerESUploader
-from .helper import batch_get_pmid_eutils
+from .helper import PubMedMixin
 
 
-class NCBIGeoUploader(CrawlerESUploader):
+class NCBIGeoUploader(PubMedMixin, CrawlerESUploader):
     NAME = 'ncbi_geo'
     BIOTHING_TYPE = 'dataset'  # TODO: is this the proper type?
     BIOTHING_VERSION = 'c1.0'
@@ -24,6 +21,11 @@ class NCBIGeoUploader(CrawlerESUploader):
     # INDEX_SETTINGS = {}
     # INDEX_MAPPINGS = {}
 
+    def get_pmids(self, doc):
+        if 'Citation(s)' not in doc:
+            return []
+        return [pmid.strip() for pmid in doc['Citation(s)'].split(',')]
+
     def extract_id(self, doc):
         # the _id is left in the document
         return 'https://www.ncbi.nlm.nih.gov/geo/query/acc.cgi?acc=' + doc['_id']
@@ -74,18 +76,11 @@ class NCBIGeoUploader(CrawlerESUploader):
         if 'Citation(s)' in doc:
             funding = []
             citations = []
-            if 'API_KEY' in os.environ:
-                api_key = os.environ['API_KEY']
-            else:
-                api_key = None
-            pmids = [pmid.strip() for pmid in doc['Citation(s)'].split(',')]
-            eutils_info = batch_get_pmid_eutils(pmids, timeout=15.0, api_key=api_key)
-            # throttle request rates, NCBI says up to 10 requests per second with API Key, 3/s without.
-            if api_key is not None:
-                time.sleep(0.1)
-            else:
-                time.sleep(0.35)
+            pmids = self.get_pmids(doc)
+            eutils_info = self.get_eutils_info(pmids)
             for pmid in pmids:
+                if pmid not in eutils_info:
+                    continue  # malformed or withdrawn IDs
                 grants = eutils_info[pmid]['grants']
                 citation = eutils_info[pmid]['citation']
                 funding += grants
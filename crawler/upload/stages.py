@@ -0,0 +1,241 @@
+"""
+Streaming Stages for Uploads
+
+Documents flow from one stage to the next through bounded
+queues, so that reading from the source index, transforming
+and writing to the destination index overlap in time while
+memory stays bounded.
+
+"""
+import collections
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from itertools import islice
+
+
+class StageMeter:
+    """
+    Count documents passing through a stage and report the rate.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.started = None
+
+    def __str__(self):
+        return '%s: %s docs, %.1f docs/s' % (self.name, self.count, self.rate)
+
+    @property
+    def rate(self):
+        if self.started is None:
+            return 0.0
+        elapsed = time.monotonic() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def add(self, num=1):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.count += num
+
+    def each(self, iterable):
+        """
+        Pass items through, counting one document per item.
+        """
+        self.started = time.monotonic()
+        for item in iterable:
+            self.count += 1
+            yield item
+
+    def batches(self, iterable):
+        """
+        Pass batches through, counting every document in them.
+        """
+        self.started = time.monotonic()
+        for batch in iterable:
+            self.count += len(batch)
+            yield batch
+
+
+def report(*meters):
+    logging.info(' | '.join(str(meter) for meter in meters))
+
+
+def batched(iterable, size):
+    """
+    Group items into lists of at most size items.
+    """
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def threaded(iterable, maxsize):
+    """
+    Consume an iterable on a background thread.
+    Items are handed over through a queue of maxsize items.
+    Exceptions from the iterable are raised in the consumer.
+    """
+    return merged([iterable], maxsize)
+
+
+def merged(iterables, maxsize):
+    """
+    Consume each iterable on its own background thread,
+    yielding items in the order they arrive, as threaded.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stopped = threading.Event()
+    finished = object()  # one per iterable
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                items.put(item, timeout=1)
+            except queue.Full:
+                continue
+            return True
+        return False
+
+    def produce(iterable):
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+        except Exception as exc:  # raised again in the consumer
+            put(exc)
+        finally:
+            put(finished)
+
+    for iterable in iterables:
+        thread = threading.Thread(target=produce, args=(iterable,), name='stage', daemon=True)
+        thread.start()
+    try:
+        remaining = len(iterables)
+        while remaining:
+            item = items.get()
+            if item is finished:
+                remaining -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+    finally:
+        stopped.set()
+
+
+def pooled(executor, func, iterable, max_pending):
+    """
+    Like executor.map, but submit at most max_pending tasks ahead
+    of the consumer instead of the whole input at once.
+    Results are yielded in input order.
+    """
+    pending = collections.deque()
+    for item in iterable:
+        pending.append(executor.submit(func, item))
+        if len(pending) >= max_pending:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class Checkpoint:
+    """
+    Persist how far an upload got in a local state file.
+
+    Source documents are read in a stable order. The position of the
+    last source document of every batch is remembered when the batch
+    is read, and saved once every document transformed from that batch
+    has been written, so that a later run can continue right after it.
+
+    Positions of a point in time are only valid for the source index
+    as it was, so they are saved with its state and not resumed from
+    once the index changed, see DataReindex.src_state().
+    """
+
+    def __init__(self, path, src_index, dest_index):
+        self.path = path
+        self.src_index = src_index
+        self.dest_index = dest_index
+        self.source = None  # state of the source index when the scan started
+        self.count = 0  # documents written, including previous runs
+
+        self._keys = collections.deque()  # positions of the last source document of batches read
+        self._pending = collections.deque()  # [key, docs not yet written]
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Return the source position to continue after, None to start over.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path) as file:
+            state = json.load(file)
+        if (state['src_index'], state['dest_index']) != (self.src_index, self.dest_index):
+            raise ValueError(
+                f"Checkpoint {self.path} is for {state['src_index']} -> {state['dest_index']}.")
+        # an _id position stays valid, a point in time position does not
+        if isinstance(state['after'], list) and state.get('source') != self.source:
+            raise ValueError(
+                f"{self.src_index} changed since checkpoint {self.path} was saved, "
+                "its positions no longer apply. Remove it to start over.")
+        self.count = state['count']
+        logging.info('Resuming after %s, %s docs already uploaded.', state['after'], self.count)
+        return state['after']
+
+    def save(self, after):
+        state = {
+            'src_index': self.src_index,
+            'dest_index': self.dest_index,
+            'after': after,
+            'source': self.source,
+            'count': self.count
+        }
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def mark(self, batches, key=lambda doc: doc['_id']):
+        """
+        Remember the position of the last source document
+        of each batch, before transforming.
+        """
+        for batch in batches:
+            self._keys.append(key(batch[-1]))
+            yield batch
+
+    def track(self, results):
+        """
+        Pair each transformed batch with its source position.
+        """
+        for result in results:
+            with self._lock:
+                self._pending.append([self._keys.popleft(), len(result)])
+            yield result
+
+    def ack(self):
+        """
+        Record that one more document has been written, in order.
+        """
+        with self._lock:
+            self.count += 1
+            after = None
+            while self._pending[0][1] == 0:  # batches with nothing to write
+                after = self._pending.popleft()[0]
+            self._pending[0][1] -= 1
+            while self._pending and self._pending[0][1] == 0:
+                after = self._pending.popleft()[0]
+        if after is not None:
+            self.save(after)
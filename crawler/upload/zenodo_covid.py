@@ -4,11 +4,11 @@ python -m crawler.upload --uploader=zenodo_covid --src-index=crawler_zenodo_covi
 import re
 from datetime import datetime
 
-import requests
-
 from . import CrawlerESUploader
+from .mappings import RemoteMapping
 
 MAPPING_URL = 'https://raw.githubusercontent.com/SuLab/outbreak.info-resources/master/outbreak_resources_es_mapping.json'
+MAPPING = RemoteMapping(MAPPING_URL)
 
 
 class ZenodoCovidUploader(CrawlerESUploader):
@@ -47,7 +47,7 @@ class ZenodoCovidUploader(CrawlerESUploader):
     @property
     def INDEX_MAPPINGS(self):
         return {
-            "properties": requests.get(MAPPING_URL).json(),
+            "properties": MAPPING.get(),
             "dynamic": False
         }
 